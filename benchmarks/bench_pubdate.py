@@ -0,0 +1,49 @@
+#! /usr/bin/python3
+
+# Per-item cost of parsing pubDates, run from the repository root:
+#   python benchmarks/bench_pubdate.py
+
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dateutil.parser import parse
+
+from feed.parser import parse_pub_date
+
+N = 10000
+
+def dates():
+    # A feed's worth of distinct RFC 822 dates, one a week, in the usual variations
+    start = datetime(2010, 1, 4, 9, 30)
+    formats = ("%a, %d %b %Y %H:%M:%S +0000", "%a, %d %b %Y %H:%M:%S GMT", "%a, %d %b %Y %H:%M:%S -0500", "%d %b %Y %H:%M:%S PST")
+    return [(start + timedelta(weeks=i)).strftime(formats[i % len(formats)]) for i in range(N)]
+
+def per_item(f, values):
+    seconds = min(timeit.repeat(lambda: [f(value) for value in values], number=1, repeat=5))
+    return seconds / len(values) * 1e6
+
+def main():
+    values = dates()
+    uncached = parse_pub_date.__wrapped__
+    # 12 hour clocks too, which the fast path has to leave to dateutil
+    for value in values[:len(values) // 10] + ["Wed, 3 Jan 2024 10:00 PM", "Wed, 3 Jan 2024 10:00 am +0000"]:
+        assert uncached(value) == parse(value, ignoretz=True), value
+
+    print(f"{N} RFC 822 dates, microseconds per item:")
+    print(f"  dateutil              {per_item(lambda value: parse(value, ignoretz=True), values):8.2f}")
+    print(f"  fast path             {per_item(uncached, values):8.2f}")
+    parse_pub_date.cache_clear()
+    # The same episodes come round again on every fetch of the feed
+    cached = values[:1000]
+    for value in cached:
+        parse_pub_date(value)
+    print(f"  fast path, refetched  {per_item(parse_pub_date, cached):8.2f}")
+    other = ["2019-01-17T00:18:00Z", "2019-01-17 00:18"]
+    print(f"  fallback (ISO 8601)   {per_item(uncached, other * 500):8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import itertools
+import logging
+import threading
+from urllib.parse import urlsplit
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+
+class Download:
+    def __init__(self, priority, order, channel, item):
+        self.priority = priority
+        self.order = order
+        self.channel = channel
+        self.item = item
+        self.host = urlsplit(item.enclosure.url).netloc
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+
+    def sort_key(self):
+        return (self.priority, self.order)
+
+    def __str__(self):
+        return f"{self.channel.title}: {self.item.title}"
+
+class Downloader:
+    """
+    Download queue served by a fixed pool of workers. A worker always picks
+    the most urgent download whose host isn't already at max_per_host, so a
+    slow CDN can't tie up the whole pool. Finished downloads are dropped, not
+    kept around for joining.
+    """
+    def __init__(self, download, workers=4, max_per_host=2):
+        self.download = download
+        self.max_per_host = max_per_host
+        self.cond = threading.Condition()
+        self.order = itertools.count()
+        self.pending = {}
+        self.active = {}
+        self.host_count = {}
+        self.closed = False
+        self.workers = []
+        for i in range(workers):
+            t = threading.Thread(target=self.worker, name=f"Downloader {i}", daemon=True)
+            t.start()
+            self.workers.append(t)
+
+    def add(self, channel, item, priority=PRIORITY_NORMAL):
+        key = (channel.title, item.key())
+        with self.cond:
+            if key in self.active:
+                return self.active[key]
+            if key in self.pending:
+                download = self.pending[key]
+                download.priority = min(download.priority, priority)
+                return download
+            download = Download(priority, next(self.order), channel, item)
+            self.pending[key] = download
+            self.cond.notify()
+            return download
+
+    def cancel(self, channel, item):
+        key = (channel.title, item.key())
+        with self.cond:
+            download = self.pending.pop(key, None) or self.active.get(key)
+            if download is None:
+                return False
+            # Active downloads stop at their next chunk
+            download.cancelled.set()
+            if key not in self.active:
+                download.done.set()
+                self.cond.notify_all()
+            return True
+
+    def get(self, channel, item):
+        key = (channel.title, item.key())
+        with self.cond:
+            return self.active.get(key) or self.pending.get(key)
+
+    def depth(self):
+        with self.cond:
+            return len(self.pending)
+
+    def queued(self):
+        with self.cond:
+            return list(self.active.values()) + sorted(self.pending.values(), key=Download.sort_key)
+
+    def next_download(self):
+        with self.cond:
+            while not self.closed:
+                for key, download in sorted(self.pending.items(), key=lambda kv: kv[1].sort_key()):
+                    if self.host_count.get(download.host, 0) < self.max_per_host:
+                        del self.pending[key]
+                        self.active[key] = download
+                        self.host_count[download.host] = self.host_count.get(download.host, 0) + 1
+                        return key, download
+                self.cond.wait()
+            return None, None
+
+    def worker(self):
+        while True:
+            key, download = self.next_download()
+            if download is None:
+                return
+            try:
+                self.download(download.channel, download.item, download.cancelled)
+            except Exception:
+                logging.exception(f"Downloading {download} failed")
+            with self.cond:
+                del self.active[key]
+                self.host_count[download.host] -= 1
+                download.done.set()
+                self.cond.notify_all()
+
+    def reserve(self, host, n):
+        # Up to n more connections to host for a download that's already running, however many are free now
+        with self.cond:
+            n = max(min(n, self.max_per_host - self.host_count.get(host, 0)), 0)
+            self.host_count[host] = self.host_count.get(host, 0) + n
+            return n
+
+    def release(self, host, n):
+        with self.cond:
+            self.host_count[host] -= n
+            self.cond.notify_all()
+
+    def join(self):
+        with self.cond:
+            while self.pending or self.active:
+                self.cond.wait()
+
+    def quit(self):
+        # Unfinished downloads keep their .part file and can be resumed later
+        with self.cond:
+            self.closed = True
+            for download in list(self.pending.values()) + list(self.active.values()):
+                download.cancelled.set()
+                download.done.set()
+            self.pending.clear()
+            self.cond.notify_all()
+        for t in self.workers:
+            t.join()
@@ -0,0 +1,38 @@
+import logging
+import queue
+import threading
+
+class EventBus:
+    """
+    Tells the rest of ycast when background work finishes. Handlers
+    subscribed to a kind of event are called on the thread that published
+    it; a message, if there is one, is also queued for the REPL to print
+    the next time it's waiting for a command.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.handlers = {}
+        self.messages = queue.Queue()
+
+    def subscribe(self, kind, handler):
+        with self.lock:
+            self.handlers.setdefault(kind, []).append(handler)
+
+    def publish(self, kind, message=None, **data):
+        with self.lock:
+            handlers = list(self.handlers.get(kind, ()))
+        for handler in handlers:
+            try:
+                handler(**data)
+            except Exception:
+                logging.exception(f"Handling {kind} failed")
+        if message is not None:
+            self.messages.put(message)
+
+    def drain(self):
+        messages = []
+        while True:
+            try:
+                messages.append(self.messages.get_nowait())
+            except queue.Empty:
+                return messages
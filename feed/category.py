@@ -1,4 +1,16 @@
-class Category:
+import sys
+
+from feed.record import Record
+
+class Category(Record):
+    __slots__ = ("value", "domain")
+
     def __init__(self):
         self.value = ""
-        self.domain = ""
\ No newline at end of file
+        self.domain = ""
+
+    def __setstate__(self, d):
+        super().__setstate__(d)
+        # The same few categories are repeated on every episode of a feed
+        self.value = sys.intern(self.value or "")
+        self.domain = sys.intern(self.domain or "")
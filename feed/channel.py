@@ -1,7 +1,14 @@
-class Channel:
+from feed.episodes import EpisodeList
+from feed.record import Record
+
+class Channel(Record):
+    __slots__ = ("items", "title", "link", "description", "language", "copyright", "managingEditor",
+                 "webMaster", "pubDate", "lastBuildDate", "category", "generator", "docs", "cloud", "ttl",
+                 "image", "textInput", "skipHours", "skipDays", "etag", "last_modified")
+
     def __init__(self):
         # Spec
-        self.items = []
+        self.items = EpisodeList()
         self.title = ""
         self.link = ""
         self.description = ""
@@ -12,15 +19,24 @@ class Channel:
         self.webMaster = ""
         self.pubDate = ""
         self.lastBuildDate = ""
-        self.category = []
+        self.category = ()
         self.generator = ""
         self.docs = ""
         self.cloud = None
         self.ttl = 60
         self.image = None
         self.textInput = None
-        self.skipHours = ""
-        self.skipDays = ""
+        self.skipHours = ()
+        self.skipDays = ()
+
+        # Internal
+        self.etag = ""
+        self.last_modified = ""
+
+    def __setstate__(self, d):
+        super().__setstate__(d)
+        if isinstance(self.items, list):
+            self.items = EpisodeList(self.items)
 
     def info_str(self):
         res = []
@@ -1,4 +1,8 @@
-class Enclosure:
+from feed.record import Record
+
+class Enclosure(Record):
+    __slots__ = ("url", "length", "type")
+
     def __init__(self):
         self.url = ""
         self.length = ""
@@ -0,0 +1,81 @@
+from bisect import bisect_right
+from datetime import datetime
+
+class EpisodeList:
+    """
+    A channel's episodes, indexed by Item.key() and ordered newest first.
+
+    Entries are stored oldest first so that the common case, a new episode
+    arriving from an update, is a plain append. Indexing and slicing are
+    mapped onto that storage, so the list can be handed to Paginator as is.
+    """
+    def __init__(self, items=()):
+        self.entries = []
+        self.dates = []
+        self.index = {}
+        self.extend(items)
+
+    def __getstate__(self):
+        return {"entries": self.entries}
+
+    def __setstate__(self, d):
+        self.entries = []
+        self.dates = []
+        self.index = {}
+        self.extend(d["entries"])
+
+    def add(self, item):
+        key = item.key()
+        if key in self.index:
+            return False
+        date = sort_date(item)
+        if not self.dates or date >= self.dates[-1]:
+            self.entries.append(item)
+            self.dates.append(date)
+        else:
+            pos = bisect_right(self.dates, date)
+            self.entries.insert(pos, item)
+            self.dates.insert(pos, date)
+        self.index[key] = item
+        return True
+
+    def extend(self, items):
+        new = []
+        for item in items:
+            key = item.key()
+            if key not in self.index:
+                self.index[key] = item
+                new.append(item)
+        if not new:
+            return
+        # Sorting is linear when the new items are already in (either) order
+        self.entries.extend(new)
+        self.entries.sort(key=sort_date)
+        self.dates = [sort_date(item) for item in self.entries]
+
+    def get(self, key, default=None):
+        return self.index.get(key, default)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return reversed(self.entries)
+
+    def __getitem__(self, i):
+        n = len(self.entries)
+        if isinstance(i, slice):
+            return [self.entries[n - 1 - j] for j in range(*i.indices(n))]
+        if i < 0:
+            i += n
+        if i < 0 or i >= n:
+            raise IndexError("episode index out of range")
+        return self.entries[n - 1 - i]
+
+
+def sort_date(item):
+    # Undated episodes sort as the newest, like parse_channel used to do
+    return item.pubDate if item.pubDate else datetime.max
@@ -1,4 +1,8 @@
-class GUID:
+from feed.record import Record
+
+class GUID(Record):
+    __slots__ = ("value", "isPermaLink")
+
     def __init__(self):
         self.value = ""
         self.isPermaLink = True
@@ -7,10 +11,17 @@ class GUID:
         return self.value
     
     def __hash__(self):
-        return self.value
+        return hash(self.value)
     
     def __eq__(self, other):
+        if not isinstance(other, GUID):
+            return NotImplemented
         return self.value == other.value
     
     def __ne__(self, other):
-        return not (self.value == other.value)
\ No newline at end of file
+        if not isinstance(other, GUID):
+            return NotImplemented
+        return not (self.value == other.value)
+
+# Shared by every item without a <guid>, never changed
+EMPTY_GUID = GUID()
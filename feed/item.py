@@ -1,6 +1,13 @@
 import html2text
 
-class Item:
+from feed.record import Record
+from feed.guid import EMPTY_GUID
+from feed.source import EMPTY_SOURCE
+
+class Item(Record):
+    __slots__ = ("title", "link", "description", "author", "category", "comments", "enclosure", "guid",
+                 "pubDate", "source", "filename", "downloaded", "progress", "gain", "text", "listing")
+
     def __init__(self):
         # Spec
         self.title = ""
@@ -8,20 +15,54 @@ class Item:
         self.description = ""
         # Optional
         self.author = ""
-        self.category = []
+        self.category = ()
         self.comments = ""
         self.enclosure = None
-        self.guid = None
+        self.guid = EMPTY_GUID
         self.pubDate = ""
-        self.source = None
+        self.source = EMPTY_SOURCE
 
         # Internal
         self.filename = ""
         self.downloaded = False
         self.progress = 0
+        # dB that brings the episode to a common loudness, None until analyzed
+        self.gain = None
+        # description as plain text, None until rendered
+        self.text = None
+        # (downloaded, line) of the last list_str()
+        self.listing = None
+
+    def __getstate__(self):
+        d = super().__getstate__()
+        # Cheap to redo, not worth saving
+        d.pop('listing', None)
+        return d
+
+    def __setstate__(self, d):
+        super().__setstate__(d)
+        self.listing = None
+        # Items pickled before the shared empty ones had a GUID() and Source() each
+        if self.guid == EMPTY_GUID and self.guid.isPermaLink:
+            self.guid = EMPTY_GUID
+        if self.source is not None and not self.source.value and not self.source.url:
+            self.source = EMPTY_SOURCE
+        if not self.category:
+            self.category = ()
+
+    def render(self):
+        # html2text is slow, so the description is converted once and kept (and saved) with the item
+        if self.text is None:
+            self.text = html2text.HTML2Text().handle(self.description)
+        return self.text
+
+    def list_str(self):
+        # Only formatted again when what it shows changes
+        if self.listing is None or self.listing[0] != self.downloaded:
+            self.listing = (self.downloaded, f"{self.title} ({self.enclosure.url}) Downloaded={self.downloaded}")
+        return self.listing[1]
     
     def info_str(self):
-        h = html2text.HTML2Text()
         res = []
         res.append(f"{self.title} ({self.enclosure.url})\n")
         if self.author:
@@ -38,9 +79,15 @@ class Item:
             res.append(f"GUID: {self.guid}\n")
         if self.comments:
             res.append(f"Comments: {self.comments}\n")
-        res.append(f"Description: {h.handle(self.description)}\n")
+        res.append(f"Description: {self.render()}\n")
         res.append(f"Downloaded: {self.downloaded}")
         return "".join(res)
     
+    def key(self):
+        # Identifies the episode across fetches of the feed
+        if self.guid is not None and self.guid.value:
+            return self.guid.value
+        return self.title
+
     def __str__(self):
         return self.title
@@ -0,0 +1,225 @@
+import re
+import sys
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from email.utils import parsedate_tz
+from functools import lru_cache
+
+from dateutil.parser import parse
+
+from feed.channel import Channel
+from feed.episodes import sort_date
+from feed.item import Item
+from feed.category import Category
+from feed.enclosure import Enclosure
+from feed.guid import GUID
+from feed.source import Source
+from feed.cloud import Cloud
+from feed.image import Image
+from feed.textinput import TextInput
+
+CHANNEL_TEXT = {"title", "link", "description", "language", "copyright", "managingEditor",
+                "webMaster", "lastBuildDate", "generator", "docs"}
+ITEM_TEXT = {"title", "link", "description", "author", "comments"}
+IMAGE_TEXT = {"url", "title", "link", "description"}
+TEXT_INPUT_TEXT = {"title", "description", "name", "link"}
+ENCLOSURE_ATTRIBUTES = ("url", "length", "type")
+# parsedate_tz() takes "PM" for a time zone and gives the wrong hour
+AM_PM = re.compile(r"\b[ap]\.?m\b", re.IGNORECASE)
+# Everything the channel's own elements are parsed into
+CHANNEL_FIELDS = CHANNEL_TEXT | {"pubDate", "category", "cloud", "ttl", "image", "textInput", "skipHours", "skipDays"}
+
+class FeedParser:
+    """
+    Incremental RSS parser. Bytes are pushed in with feed() as they arrive
+    from the network and every element is handled exactly once, on its end
+    event. Elements are dropped from the tree as soon as they've been copied
+    into the Channel/Item, so memory doesn't grow with the size of the feed.
+
+    If known_keys is given, parsing stops at the first item whose key is in
+    it, as long as the item after it is older: in a newest first feed
+    everything after that is already known. Feeds that list oldest first
+    are read to the end. Channel elements that come after where it stopped
+    are taken from previous, the Channel as it was last fetched.
+    """
+    def __init__(self, known_keys=None, previous=None):
+        self.parser = ET.XMLPullParser(events=("start", "end"))
+        self.known_keys = known_keys
+        self.previous = previous
+        self.done = False
+        # sort_date() of the first known item, once there's been one
+        self.known_date = None
+        # Set by the item after it if that one is newer
+        self.oldest_first = False
+        self.channel = Channel()
+        self.channel_element = None
+        self.item = None
+        self.items = []
+        self.path = []
+        # CHANNEL_FIELDS the feed has had so far
+        self.seen = set()
+
+    def feed(self, data):
+        self.parser.feed(data)
+        self.handle_events()
+
+    def close(self):
+        if not self.done:
+            self.parser.close()
+            self.handle_events()
+        if self.channel_element is None:
+            # Well formed, but Atom, an error page or anything else that isn't RSS
+            raise ET.ParseError("not an RSS feed, there's no channel")
+        if self.done and self.previous is not None:
+            # Stopped before the rest of the channel's elements, they're as they were
+            for field in CHANNEL_FIELDS - self.seen:
+                setattr(self.channel, field, getattr(self.previous, field))
+        if "title" not in self.seen and not self.channel.title:
+            raise ET.ParseError("not an RSS feed, the channel has no title")
+        self.channel.items.extend(self.items)
+        return self.channel
+
+    def handle_events(self):
+        for event, element in self.parser.read_events():
+            if self.done:
+                return
+            if event == "start":
+                self.start(element)
+            else:
+                self.end(element)
+
+    def start(self, element):
+        tag = element.tag
+        parent = self.path[-1] if self.path else None
+        self.path.append(tag)
+        if tag == "channel":
+            self.channel_element = element
+        elif parent == "channel":
+            if tag == "item":
+                self.item = Item()
+            elif tag == "image":
+                self.channel.image = Image()
+            elif tag in ("textinput", "textInput"):
+                self.channel.textInput = TextInput()
+
+    def end(self, element):
+        tag = self.path.pop()
+        parent = self.path[-1] if self.path else None
+        if parent == "item":
+            self.item_field(self.item, tag, element)
+        elif parent == "channel":
+            if tag == "item":
+                self.end_item(self.item)
+                self.item = None
+            else:
+                self.channel_field(self.channel, tag, element)
+                self.seen.add("textInput" if tag == "textinput" else tag)
+            # Everything under this child has been copied out
+            self.channel_element.clear()
+        elif parent == "image" and self.path[-2:-1] == ["channel"]:
+            image_field(self.channel.image, tag, element)
+        elif parent in ("textinput", "textInput") and self.path[-2:-1] == ["channel"]:
+            if tag in TEXT_INPUT_TEXT:
+                setattr(self.channel.textInput, tag, element.text or "")
+
+    def end_item(self, item):
+        if self.known_keys is not None:
+            if self.known_date is not None and not self.oldest_first:
+                if sort_date(item) <= self.known_date:
+                    self.done = True
+                    return
+                # Oldest first, the new episodes are still to come
+                self.oldest_first = True
+            if item.key() in self.known_keys:
+                if self.known_date is None:
+                    # Which way round the feed is only shows with the next item
+                    self.known_date = sort_date(item)
+                return
+        self.items.append(item)
+
+    def channel_field(self, channel, tag, element):
+        if tag in CHANNEL_TEXT:
+            setattr(channel, tag, element.text or "")
+        elif tag == "pubDate":
+            channel.pubDate = parse_pub_date(element.text)
+        elif tag == "category":
+            channel.category += (parse_category(element),)
+        elif tag == "cloud":
+            channel.cloud = Cloud()
+            for key, value in element.items():
+                setattr(channel.cloud, key, value)
+        elif tag == "ttl":
+            channel.ttl = int(element.text)
+        elif tag == "skipHours":
+            # Hours of the day (GMT) the feed shouldn't be fetched in
+            channel.skipHours = tuple(int(hour.text) for hour in element.iter("hour")
+                                      if hour.text and hour.text.strip().isdigit())
+        elif tag == "skipDays":
+            channel.skipDays = tuple(day.text.strip() for day in element.iter("day") if day.text)
+
+    def item_field(self, item, tag, element):
+        if tag in ITEM_TEXT:
+            setattr(item, tag, element.text or "")
+        elif tag == "pubDate":
+            item.pubDate = parse_pub_date(element.text)
+        elif tag == "category":
+            item.category += (parse_category(element),)
+        elif tag == "enclosure":
+            item.enclosure = Enclosure()
+            for key in ENCLOSURE_ATTRIBUTES:
+                setattr(item.enclosure, key, element.get(key, ""))
+        elif tag == "guid":
+            item.guid = GUID()
+            item.guid.value = element.text or ""
+            item.guid.isPermaLink = element.get("isPermaLink", "true").lower() != "false"
+        elif tag == "source":
+            item.source = Source()
+            item.source.value = element.text or ""
+            item.source.url = element.get("url", "")
+
+
+def image_field(image, tag, element):
+    if tag in IMAGE_TEXT:
+        setattr(image, tag, element.text or "")
+    elif tag == "width":
+        image.width = int(element.text)
+    elif tag == "height":
+        image.height = int(element.text)
+
+
+def parse_category(element):
+    cat = Category()
+    # The same few categories are repeated on every episode of a feed
+    cat.value = sys.intern(element.text or "")
+    cat.domain = sys.intern(element.get("domain", ""))
+    return cat
+
+
+def parse_channel(chunks, known_keys=None, previous=None):
+    """
+    chunks is either the whole document (str or bytes) or an iterable of
+    byte chunks such as Response.iter_content(). Raises ET.ParseError if
+    it isn't an RSS feed.
+    """
+    if isinstance(chunks, (str, bytes)):
+        chunks = [chunks]
+    parser = FeedParser(known_keys, previous)
+    for chunk in chunks:
+        parser.feed(chunk)
+        if parser.done:
+            # Don't bother reading the rest of the feed
+            break
+    return parser.close()
+
+
+@lru_cache(maxsize=4096)
+def parse_pub_date(pubDate):
+    # Nearly every feed uses RFC 822 dates, dateutil is slow and only needed for the rest.
+    # Like ignoretz, the time is kept as written and the zone dropped.
+    parsed = parsedate_tz(pubDate) if not AM_PM.search(pubDate) else None
+    if parsed is not None:
+        try:
+            return datetime(*parsed[:6])
+        except ValueError:
+            pass
+    return parse(pubDate, ignoretz=True)
@@ -0,0 +1,43 @@
+class Record:
+    """
+    Base for the feed model classes, which are kept around by the hundred
+    thousand. Subclasses list their fields in __slots__ instead of having a
+    __dict__, and are pickled as a dict of only the fields that differ from
+    what __init__ sets. Unpickling starts from __init__'s defaults, so dicts
+    from before a field existed, including the whole __dict__ pickled
+    before __slots__, load as well.
+    """
+    __slots__ = ()
+
+    def __getstate__(self):
+        defaults = defaults_of(type(self))
+        d = {}
+        for name, default in defaults.items():
+            value = getattr(self, name)
+            if value is default:
+                continue
+            if type(value) is type(default) and not isinstance(value, Record) and value == default:
+                continue
+            d[name] = value
+        return d
+
+    def __setstate__(self, d):
+        self.__init__()
+        fields = defaults_of(type(self))
+        for name, value in d.items():
+            # Fields that have since been dropped are ignored
+            if name in fields:
+                setattr(self, name, value)
+
+
+# Field name to default value, per class
+DEFAULTS = {}
+
+def defaults_of(cls):
+    defaults = DEFAULTS.get(cls)
+    if defaults is None:
+        instance = cls()
+        names = [name for klass in reversed(cls.__mro__) for name in getattr(klass, "__slots__", ())]
+        defaults = {name: getattr(instance, name) for name in names}
+        DEFAULTS[cls] = defaults
+    return defaults
@@ -1,4 +1,11 @@
-class Source:
+from feed.record import Record
+
+class Source(Record):
+    __slots__ = ("value", "url")
+
     def __init__(self):
         self.value = ""
         self.url = ""
+
+# Shared by every item without a <source>, never changed
+EMPTY_SOURCE = Source()
@@ -0,0 +1,168 @@
+import io
+import os
+import struct
+from array import array
+from bisect import bisect_right
+
+# kbps by [MPEG1?][layer] and bitrate index, 0 is free format
+BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Hz by version bits (MPEG 2.5, reserved, MPEG 2, MPEG 1) and sample rate index
+SAMPLE_RATES = {0: (11025, 12000, 8000), 2: (22050, 24000, 16000), 3: (44100, 48000, 32000)}
+# Sidecar header: size of the .mp3 it was built from, number of frames
+HEADER = struct.Struct("<qq")
+# Frames that have to follow one another before a sync word is believed
+SYNC_FRAMES = 4
+
+def parse_header(b):
+    # (frame length, samples, sample rate) of the frame header in b, or None
+    if b[0] != 0xFF or b[1] & 0xE0 != 0xE0:
+        return None
+    version = (b[1] >> 3) & 3
+    layer = 4 - ((b[1] >> 1) & 3)
+    bitrate = b[2] >> 4
+    rate = (b[2] >> 2) & 3
+    if version == 1 or layer == 4 or bitrate in (0, 15) or rate == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = BITRATES[(mpeg1, layer)][bitrate] * 1000
+    rate = SAMPLE_RATES[version][rate]
+    padding = (b[2] >> 1) & 1
+    if layer == 1:
+        return (12 * bitrate // rate + padding) * 4, 384, rate
+    samples = 1152 if mpeg1 or layer == 2 else 576
+    return samples // 8 * bitrate // rate + padding, samples, rate
+
+def in_sync(data, pos):
+    # Whether SYNC_FRAMES frames follow back to back from pos, or run to the end of data
+    for _ in range(SYNC_FRAMES):
+        if pos == len(data):
+            return True
+        header = parse_header(data[pos:pos + 4]) if pos + 4 <= len(data) else None
+        if header is None or header[0] < 4:
+            return False
+        pos += header[0]
+    return True
+
+def id3_size(data):
+    # Bytes taken up by an ID3v2 tag at the start of the file
+    if data[:3] != b"ID3" or len(data) < 10:
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    return 10 + size + (10 if data[5] & 0x10 else 0)
+
+class FrameIndex:
+    """
+    Byte offset and start time of every MPEG audio frame in a file, so a
+    position in milliseconds maps to the frame that contains it with a
+    binary search. Built by scanning the frame headers once, then cached in
+    a .frames file next to the episode.
+    """
+    def __init__(self, offsets, times):
+        self.offsets = offsets
+        self.times = times
+        self.length = 0.0
+
+    @classmethod
+    def scan(cls, data):
+        offsets = array("q")
+        times = array("d")
+        ms = 0.0
+        pos = id3_size(data)
+        # Whether pos is where the last frame ended, rather than a sync word that's just been found
+        synced = False
+        while pos + 4 <= len(data):
+            header = parse_header(data[pos:pos + 4])
+            if header is None or header[0] < 4 or not (synced or in_sync(data, pos)):
+                # Junk between frames, or 0xFFE in something that isn't MPEG audio at all
+                synced = False
+                pos = data.find(b"\xff", pos + 1)
+                if pos == -1:
+                    break
+                continue
+            synced = True
+            length, samples, rate = header
+            first = data[pos:pos + min(length, 192)]
+            if offsets or not (b"Xing" in first or b"Info" in first or b"VBRI" in first):
+                # A Xing/Info/VBRI frame is the encoder's summary, not audio
+                offsets.append(pos)
+                times.append(ms)
+                ms += samples * 1000 / rate
+            pos += length
+        index = cls(offsets, times)
+        index.length = ms
+        return index
+
+    @classmethod
+    def load(cls, filename):
+        # Reads the cached index, (re)building it if it's missing or stale
+        path = f"{filename}.frames"
+        size = os.path.getsize(filename)
+        try:
+            with open(path, "rb") as file:
+                built_from, n = HEADER.unpack(file.read(HEADER.size))
+                if built_from == size:
+                    offsets = array("q")
+                    times = array("d")
+                    offsets.fromfile(file, n)
+                    times.fromfile(file, n + 1)
+                    index = cls(offsets, times)
+                    index.length = times.pop()
+                    return index
+        except (OSError, EOFError, struct.error):
+            pass
+        with open(filename, "rb") as file:
+            index = cls.scan(file.read())
+        with open(path, "wb") as file:
+            file.write(HEADER.pack(size, len(index.offsets)))
+            index.offsets.tofile(file)
+            index.times.tofile(file)
+            array("d", [index.length]).tofile(file)
+        return index
+
+    def seek(self, ms):
+        # (byte offset, start in ms) of the frame playing at ms
+        if not self.offsets:
+            return 0, 0
+        i = max(bisect_right(self.times, ms) - 1, 0)
+        return self.offsets[i], int(self.times[i])
+
+    def duration(self):
+        return int(self.length)
+
+class FileSlice(io.RawIOBase):
+    # The part of a file from offset on, as if that were the whole file
+    def __init__(self, filename, offset):
+        self.file = open(filename, "rb")
+        self.offset = offset
+        self.file.seek(offset)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        return self.file.readinto(b)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            offset += self.offset
+        pos = self.file.seek(offset, whence)
+        if pos < self.offset:
+            pos = self.file.seek(self.offset)
+        return pos - self.offset
+
+    def tell(self):
+        return self.file.tell() - self.offset
+
+    def close(self):
+        self.file.close()
+        super().close()
@@ -0,0 +1,98 @@
+import logging
+import queue
+import threading
+
+import numpy as np
+
+import pygame
+
+# Where episodes are normalized to; pygame can't turn the volume up past 1,
+# so quieter episodes get as close to it as the user's volume allows
+TARGET_LOUDNESS = -18.0
+
+# Frames turned into float at a time while measuring
+LOUDNESS_CHUNK = 1 << 18
+
+def integrated_loudness(samples, rate):
+    """
+    Gated loudness in dB of a (samples, channels) PCM array, after
+    ITU-R BS.1770: mean square over 400ms blocks with 75% overlap, blocks
+    under -70dB dropped, then blocks more than 10dB under the average of
+    the rest dropped. No K-weighting filter, which would need an IIR pass
+    that doesn't vectorize.
+    """
+    if np.issubdtype(samples.dtype, np.integer):
+        scale = float(np.iinfo(samples.dtype).max) + 1
+    else:
+        scale = 1.0
+    block = int(0.4 * rate)
+    step = block // 4
+    if len(samples) < block:
+        return None
+    # Every block's mean square from one running sum, of which only the
+    # values at block edges are kept
+    starts = np.arange(0, len(samples) - block + 1, step)
+    edges, where = np.unique(np.concatenate((starts, starts + block)), return_inverse=True)
+    totals = np.empty(len(edges))
+    running = 0.0
+    i = 0
+    # A chunk at a time, float copies of a whole episode run to gigabytes
+    for chunk in range(0, len(samples), LOUDNESS_CHUNK):
+        x = samples[chunk:chunk + LOUDNESS_CHUNK].astype(np.float32) / scale
+        power = (x * x).mean(axis=1) if x.ndim > 1 else x * x
+        total = np.concatenate(([running], running + np.cumsum(power, dtype=np.float64)))
+        j = np.searchsorted(edges, chunk + len(power), side="right")
+        totals[i:j] = total[edges[i:j] - chunk]
+        i = j
+        running = total[-1]
+    z = (totals[where[len(starts):]] - totals[where[:len(starts)]]) / block
+    loudness = 10 * np.log10(z + 1e-12) - 0.691
+    z = z[loudness > -70]
+    if not len(z):
+        return None
+    relative = 10 * np.log10(z.mean()) - 0.691 - 10
+    z = z[10 * np.log10(z + 1e-12) - 0.691 > relative]
+    return float(10 * np.log10(z.mean()) - 0.691)
+
+
+def analyze_file(filename):
+    # Gain in dB that brings the episode to TARGET_LOUDNESS
+    sound = pygame.mixer.Sound(file=filename)
+    loudness = integrated_loudness(pygame.sndarray.samples(sound), pygame.mixer.get_init()[0])
+    if loudness is None:
+        return 0.0
+    return TARGET_LOUDNESS - loudness
+
+class LoudnessAnalyzer:
+    """
+    Works out Item.gain for downloaded episodes on a single background
+    thread, one at a time since each needs the whole episode decoded.
+    done(item, channel) is called with the gain set so it can be persisted.
+    """
+    def __init__(self, done):
+        self.done = done
+        self.queue = queue.Queue()
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.worker, name="Loudness", daemon=True)
+        self.thread.start()
+
+    def add(self, item, channel):
+        with self.lock:
+            if id(item) in self.pending:
+                return
+            self.pending.add(id(item))
+        self.queue.put((item, channel))
+
+    def worker(self):
+        while True:
+            item, channel = self.queue.get()
+            try:
+                if item.downloaded and item.gain is None:
+                    item.gain = analyze_file(item.filename)
+                    self.done(item, channel)
+            except Exception:
+                logging.exception(f"Analyzing {item.title} failed")
+            finally:
+                with self.lock:
+                    self.pending.discard(id(item))
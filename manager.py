@@ -1,23 +1,33 @@
-import xml.etree.ElementTree as ET
 import os
-import shutil
+import json
 import logging
+import queue
+import shutil
 import threading
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 
 import requests
-from dateutil.parser import parse
-
-from feed.channel import Channel
-from feed.item import Item
-from feed.category import Category
-from feed.enclosure import Enclosure
-from feed.guid import GUID
-from feed.source import Source
-from feed.cloud import Cloud
-from feed.image import Image
-from feed.textinput import TextInput
+
+from feed.parser import parse_channel
+from feed.episodes import EpisodeList
 from exceptions import YCastException
+from session import Session
+from downloader import Downloader, PRIORITY_NORMAL
+from metrics import Metrics
+from stream import StreamBuffer
+from events import EventBus
+from opml import parse_opml, write_opml
+
+# Big enough that writes aren't the bottleneck, small enough to stay responsive
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+# Episodes at least this big are fetched as parallel byte ranges
+SEGMENTED_MIN_SIZE = 64 * 1024 * 1024
+DOWNLOAD_SEGMENTS = 4
+# Connection drops are retried, resuming from the .part file
+DOWNLOAD_RETRIES = 2
+RETRY_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError)
 
 class ManagerException(YCastException):
     pass
@@ -28,52 +38,237 @@ class ManagerAlreadyDownloaded(ManagerException):
 class ManagerNotDownloaded(ManagerException):
     pass
 
+class ManagerNotDownloading(ManagerException):
+    pass
+
 class ManagerAlreadySubscribed(ManagerException):
     pass
 
 class ManagerInvalidURL(ManagerException):
     pass
 
+class ManagerUntitledChannel(ManagerException):
+    pass
+
 class Manager:
-    def __init__(self):
-        self.channels = {} # Pickled
+    def __init__(self, store, max_workers=8, max_per_host=2, max_downloads=4):
+        self.store = store
+        # Replaced rather than changed in place, so other threads can iterate them without a lock
+        self.channels = {}
         self.title_to_url = {}
-        self.channel_to_items = {}
-        self.threads = []
+        self.lock = threading.Lock()
+        # By channel title, held while the channel's items change
+        self.channel_locks = {}
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        # Background work by what it's working on, (channel title, item key) or a feed url
+        self.tasks = {}
+        self.tasks_lock = threading.Lock()
+        self.session = Session(max_per_host=max_per_host)
+        self.events = EventBus()
+        self.downloader = Downloader(self.download_task, workers=max_downloads, max_per_host=max_per_host)
+        self.metrics = Metrics()
+        self.metrics.add_gauge("download_queue_depth", self.downloader.depth)
+        self.streams = {}
 
         if not os.path.exists("downloads"):
-            os.makedirs("downloads")         
-    
-    def __getstate__(self):
-        d = dict(self.__dict__)
-        del d['title_to_url']
-        del d['channel_to_items']
-        del d['threads']
-        return d
-    
+            os.makedirs("downloads")
+
+        # Items are loaded on demand by load_items
+        for url, channel in self.store.load_channels():
+            self.channels[url] = channel
+            self.title_to_url[channel.title] = url
+
+        # New episodes' descriptions are converted to text in the background
+        self.render_queue = queue.Queue()
+        self.renderer = threading.Thread(target=self.render_thread, name="Rendering", daemon=True)
+        self.renderer.start()
+
+        # Don't hold up startup stat'ing every download in the library
+        self.checker = threading.Thread(target=self.check_downloads, name="Checking downloads", daemon=True)
+        self.checker.start()
+
     def __setstate__(self, d):
+        # Only used to read a manager.pkl from before the Store
         self.__dict__.update(d)
-        self.title_to_url = {}
-        self.channel_to_items = {}
-        self.threads = []
+
+    def channel_lock(self, channel):
+        with self.lock:
+            return self.channel_locks.setdefault(channel.title, threading.RLock())
+
+    def add_channel(self, url, channel):
+        self.add_channels([(url, channel)])
+
+    def add_channels(self, pairs):
+        with self.lock:
+            title_to_url = dict(self.title_to_url)
+            channels = dict(self.channels)
+            for url, channel in pairs:
+                title_to_url[channel.title] = url
+                channels[url] = channel
+            # Any channel that can be seen already has its url
+            self.title_to_url = title_to_url
+            self.channels = channels
+
+    def remove_channel(self, channel):
+        with self.lock:
+            url = self.title_to_url[channel.title]
+            channels = dict(self.channels)
+            del channels[url]
+            title_to_url = dict(self.title_to_url)
+            del title_to_url[channel.title]
+            self.channels = channels
+            self.title_to_url = title_to_url
+            self.channel_locks.pop(channel.title, None)
+            return url
+
+    def load_items(self, channel):
+        with self.channel_lock(channel):
+            if channel.items is None:
+                url = self.title_to_url[channel.title]
+                items = self.store.load_items(url)
+                # Check if a downloaded file has been deleted since last time
+                missing = []
+                for item in items:
+                    if item.downloaded and not os.path.isfile(item.filename):
+                        item.downloaded = False
+                        missing.append(item)
+                channel.items = EpisodeList(items)
+                if missing:
+                    self.store.save_items(url, missing)
+            return channel.items
+
+    def find_item(self, channel_title, key):
+        # (item, channel), or (None, None) if either is gone
+        url = self.title_to_url.get(channel_title)
+        if url is None:
+            return None, None
+        channel = self.channels.get(url)
+        if channel is None:
+            return None, None
+        item = self.load_items(channel).get(key)
+        if item is None:
+            return None, None
+        return item, channel
+
+    def search(self, query, limit=50):
+        # (item, channel) of the best matches, best first. Channels that
+        # aren't loaded stay that way, their matches are read on their own
+        # and are copies until find_item() is used to act on them
+        results = []
+        for url, key in self.store.search(query, limit):
+            channel = self.channels.get(url)
+            if channel is None:
+                continue
+            items = channel.items
+            item = items.get(key) if items is not None else self.store.load_item(url, key)
+            if item is not None:
+                results.append((item, channel))
+        return results
+
+    def render_thread(self):
+        while True:
+            job = self.render_queue.get()
+            if job is None:
+                return
+            try:
+                self.render_items(*job)
+            except Exception:
+                logging.exception(f"Rendering {job[0].title} failed")
+
+    def render_items(self, channel, items):
+        for item in items:
+            item.render()
+        with self.channel_lock(channel):
+            url = self.title_to_url.get(channel.title)
+            if url is None:
+                return
+            if channel.items is not None:
+                # If the channel was opened since, its items are other copies of these
+                loaded = [channel.items.get(item.key()) for item in items]
+                for item, copy in zip(items, loaded):
+                    if copy is not None:
+                        copy.text = item.text
+                items = [copy for copy in loaded if copy is not None]
+            self.store.save_items(url, items)
+
+    def check_downloads(self):
         # Check if a downloaded file has been deleted since last time
-        for url, channel in self.channels.items():
-            self.title_to_url[channel.title] = url
-            self.channel_to_items[channel.title] = set(channel.items)
-            for item in channel.items:
-                if item.downloaded and not os.path.isfile(item.filename):
+        for url, key, filename in self.store.load_downloaded():
+            if os.path.isfile(filename):
+                continue
+            channel = self.channels.get(url)
+            if channel is None:
+                continue
+            with self.channel_lock(channel):
+                if channel.items is not None:
+                    item = channel.items.get(key)
+                else:
+                    item = self.store.load_item(url, key)
+                if item is not None and item.downloaded and not os.path.isfile(item.filename):
                     item.downloaded = False
-    
+                    self.store.save_item(url, item)
+
+    def save_item(self, item, channel):
+        url = self.title_to_url.get(channel.title)
+        if url is None:
+            # Unsubscribed in the meantime
+            return
+        self.store.save_item(url, item)
+
     def quit(self):
+        self.checker.join()
+        # Whatever isn't rendered yet is rendered when it's first shown
+        try:
+            while True:
+                self.render_queue.get_nowait()
+        except queue.Empty:
+            pass
+        self.render_queue.put(None)
+        self.renderer.join()
         self.wait_for_all_threads()
+        # Streams stop where they are, their .part file resumes next time
+        for stream in list(self.streams.values()):
+            self.cancel_stream(*stream)
+        # Downloads aren't waited for either, they're cancelled and their .part kept
+        self.downloader.quit()
+        self.session.close()
     
+    def start_task(self, key, name, target, *args):
+        def run():
+            try:
+                target(*args)
+            except Exception as e:
+                logging.exception(f"{name} failed")
+                self.events.publish("failed", f"{name} failed: {str(e) or type(e).__name__}")
+            finally:
+                with self.tasks_lock:
+                    if self.tasks.get(key) is t:
+                        del self.tasks[key]
+        t = threading.Thread(target=run, name=name)
+        with self.tasks_lock:
+            self.tasks[key] = t
+        t.start()
+
+    def wait_for(self, key):
+        # Only blocks on work on key, not everything that's in flight
+        with self.tasks_lock:
+            t = self.tasks.get(key)
+        if t is not None and t is not threading.current_thread():
+            t.join()
+
+    def wait_for_item(self, item, channel):
+        self.wait_for((channel.title, item.key()))
+
     def wait_for_all_threads(self):
-        for thread in self.threads:
+        with self.tasks_lock:
+            tasks = list(self.tasks.values())
+        for thread in tasks:
             if thread.is_alive():
                 print(f"Waiting for: {thread.name}")
             thread.join()
 
-    def download_item(self, item, channel):
+    def download_item(self, item, channel, priority=PRIORITY_NORMAL):
         if item.downloaded:
             raise ManagerAlreadyDownloaded
 
@@ -83,211 +278,477 @@ class Manager:
             except FileExistsError:
                 pass
 
-        t = threading.Thread(target=self.download_thread, args=(
-            channel, item), name=f"Downloading {channel.title}: {item.title}")
-        t.start()
-        self.threads.append(t)
-    
-    def download_thread(self, channel, item):
+        stream = self.streams.get((channel.title, item.key()))
+        if stream is not None and stream[0].is_alive():
+            # Already being downloaded by the stream
+            return
+
+        self.downloader.add(channel, item, priority)
+
+    def cancel_download(self, item, channel):
+        if not self.downloader.cancel(channel, item):
+            raise ManagerNotDownloading
+
+    def download_filename(self, channel, item):
+        return f"downloads/{channel.title}/{item.guid}.mp3"
+
+    def download_task(self, channel, item, cancelled):
+        # What the Downloader runs, so failures are announced too
+        try:
+            self.download_thread(channel, item, cancelled)
+        except Exception as e:
+            self.events.publish("failed", f"Downloading {channel.title}: {item.title} failed: {describe_error(e)}",
+                                item=item, channel=channel)
+            raise
+
+    def download_thread(self, channel, item, cancelled=None):
         url = item.enclosure.url
+        filename = self.download_filename(channel, item)
+        # Downloads go to a .part file which is only renamed once complete,
+        # an interrupted download is picked up from where it stopped
+        part = f"{filename}.part"
+        segments = f"{filename}.segments"
+        transfer = self.metrics.start("download", f"{channel.title}: {item.title}", url)
+        status = "failed"
         try:
-            r = requests.get(url, stream=True)
+            for attempt in range(DOWNLOAD_RETRIES + 1):
+                try:
+                    if os.path.isfile(segments):
+                        complete = self.download_segmented(url, part, segments, None, cancelled, transfer)
+                    elif not os.path.isfile(part):
+                        size = self.range_size(url)
+                        if size is not None and size >= SEGMENTED_MIN_SIZE:
+                            complete = self.download_segmented(url, part, segments, size, cancelled, transfer)
+                        else:
+                            complete = self.download_single(url, part, cancelled, transfer)
+                    else:
+                        complete = self.download_single(url, part, cancelled, transfer)
+                    break
+                except RETRY_ERRORS:
+                    if attempt == DOWNLOAD_RETRIES:
+                        raise
+                    self.metrics.retry(transfer)
+            status = "done" if complete else "cancelled"
         except requests.exceptions.RequestException:
             raise ManagerInvalidURL
-        filename = f"downloads/{channel.title}/{item.guid}.mp3"
-        item.filename = filename
-        with open(filename, "wb") as file:
-            for chunk in r.iter_content(chunk_size=1024):
-                file.write(chunk)
-        item.downloaded = True
+        finally:
+            self.metrics.finish(transfer, status)
+        if not complete:
+            # Keep the .part file so it can be resumed
+            return
+        os.replace(part, filename)
+        with self.channel_lock(channel):
+            item.filename = filename
+            item.downloaded = True
+            self.save_item(item, channel)
+        self.events.publish("downloaded", f"Downloaded {channel.title}: {item.title}", item=item, channel=channel)
+
+    def metered(self, transfer, chunks):
+        for chunk in chunks:
+            self.metrics.received(transfer, len(chunk))
+            yield chunk
+
+    def download_single(self, url, part, cancelled, transfer):
+        offset = os.path.getsize(part) if os.path.isfile(part) else 0
+        # Ranges are byte offsets into the file as stored, so no compression
+        headers = {"Accept-Encoding": "identity"}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        with self.session.get(url, headers=headers, stream=True) as r:
+            # 416 means the .part file already holds everything
+            if r.status_code == 416:
+                return True
+            r.raise_for_status()
+            if r.status_code != 206:
+                # Range not supported, start from scratch
+                offset = 0
+            with open(part, "ab" if offset else "wb") as file:
+                for chunk in self.metered(transfer, r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)):
+                    if cancelled is not None and cancelled.is_set():
+                        return False
+                    file.write(chunk)
+        return True
+
+    def range_size(self, url):
+        # Size of the enclosure if the server serves byte ranges, else None
+        headers = {"Accept-Encoding": "identity", "Range": "bytes=0-0"}
+        with self.session.get(url, headers=headers, stream=True) as r:
+            content_range = r.headers.get("Content-Range", "")
+            if r.status_code != 206 or "/" not in content_range:
+                return None
+            try:
+                return int(content_range.rsplit("/", 1)[1])
+            except ValueError:
+                # bytes 0-0/*
+                return None
+
+    def download_segmented(self, url, part, segments, size, cancelled, transfer):
+        """
+        Fetches the enclosure as DOWNLOAD_SEGMENTS byte ranges, as many in
+        parallel as the host's connection limit leaves room for, each
+        written at its offset in a preallocated .part file. Per segment
+        progress is kept next to it in a .segments file for resuming.
+        """
+        if size is None:
+            with open(segments) as file:
+                state = json.load(file)
+        else:
+            step = -(-size // DOWNLOAD_SEGMENTS)
+            state = {"size": size, "segments": [[start, min(start + step, size) - 1, 0]
+                                                for start in range(0, size, step)]}
+            # The .segments file must exist before the .part file, otherwise
+            # an interruption looks like a finished single stream download
+            write_segments(segments, state)
+        if not os.path.isfile(part) or os.path.getsize(part) != state["size"]:
+            # A fresh .part has none of what the segments say they've done
+            for segment in state["segments"]:
+                segment[2] = 0
+            write_segments(segments, state)
+            with open(part, "wb") as file:
+                file.truncate(state["size"])
+
+        lock = threading.Lock()
+
+        def fetch(segment):
+            start, end, done = segment
+            if start + done > end:
+                return True
+            headers = {"Accept-Encoding": "identity", "Range": f"bytes={start + done}-{end}"}
+            unsaved = 0
+            with self.session.get(url, headers=headers, stream=True) as r, open(part, "r+b") as file:
+                if r.status_code != 206:
+                    raise requests.exceptions.HTTPError(f"Expected 206 for a range, got {r.status_code}")
+                file.seek(start + done)
+                for chunk in self.metered(transfer, r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)):
+                    if cancelled is not None and cancelled.is_set():
+                        return False
+                    file.write(chunk)
+                    with lock:
+                        segment[2] += len(chunk)
+                    unsaved += len(chunk)
+                    if unsaved >= DOWNLOAD_CHUNK_SIZE * 16:
+                        # Only what's already been written is recorded, so this stays conservative
+                        file.flush()
+                        unsaved = 0
+                        with lock:
+                            write_segments(segments, state)
+            return segment[2] == end - start + 1
+
+        # The download already has one of the host's slots, every other connection needs its own
+        host = urlsplit(url).netloc
+        extra = self.downloader.reserve(host, DOWNLOAD_SEGMENTS - 1)
+        try:
+            with ThreadPoolExecutor(max_workers=1 + extra, thread_name_prefix="Segment") as executor:
+                complete = all(list(executor.map(fetch, state["segments"])))
+        finally:
+            self.downloader.release(host, extra)
+            with lock:
+                write_segments(segments, state)
+        if complete:
+            # Before the rename: a leftover complete .part resumes as a 416
+            os.remove(segments)
+        return complete
+
+    def stream_item(self, item, channel):
+        """
+        Starts downloading item and returns a StreamBuffer that can be played
+        from straight away. The download carries on to disk after the buffer
+        is closed, so the episode ends up downloaded either way.
+        """
+        if item.downloaded:
+            raise ManagerAlreadyDownloaded
+
+        # Only one thread may write to the .part file
+        key = (channel.title, item.key())
+        download = self.downloader.get(channel, item)
+        if download is not None:
+            self.downloader.cancel(channel, item)
+            download.done.wait()
+        if key in self.streams:
+            self.cancel_stream(*self.streams.pop(key))
+
+        if not os.path.exists(f"downloads/{channel.title}"):
+            try:
+                os.makedirs(f"downloads/{channel.title}")
+            except FileExistsError:
+                pass
+
+        filename = self.download_filename(channel, item)
+        part = f"{filename}.part"
+        if os.path.isfile(f"{filename}.segments"):
+            # A segmented .part has holes, it can't be read from front to back
+            os.remove(f"{filename}.segments")
+            os.remove(part)
+        buffer = StreamBuffer(part, os.path.getsize(part) if os.path.isfile(part) else 0)
+        cancelled = threading.Event()
+        t = threading.Thread(target=self.stream_thread, args=(channel, item, buffer, cancelled),
+                             name=f"Streaming {channel.title}: {item.title}")
+        self.streams[key] = (t, cancelled, buffer)
+        t.start()
+        return buffer
+
+    def cancel_stream(self, thread, cancelled, buffer):
+        cancelled.set()
+        # The writer may be waiting for a paused reader to make room
+        buffer.cancel()
+        thread.join()
+
+    def stream_thread(self, channel, item, buffer, cancelled):
+        url = item.enclosure.url
+        filename = self.download_filename(channel, item)
+        part = f"{filename}.part"
+        offset = buffer.written
+        headers = {"Accept-Encoding": "identity"}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        transfer = self.metrics.start("stream", f"{channel.title}: {item.title}", url)
+        status = "failed"
+        try:
+            with self.session.get(url, headers=headers, stream=True) as r, open(part, "ab") as file:
+                if r.status_code != 416:
+                    r.raise_for_status()
+                    # Servers without Range support resend what's already on disk
+                    skip = offset if r.status_code != 206 else 0
+                    if "Content-Length" in r.headers:
+                        buffer.set_size(offset - skip + int(r.headers["Content-Length"]))
+                    for chunk in self.metered(transfer, r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)):
+                        if cancelled.is_set():
+                            status = "cancelled"
+                            return
+                        if skip:
+                            n = min(skip, len(chunk))
+                            chunk = chunk[n:]
+                            skip -= n
+                        # The buffer reads evicted bytes back from the file
+                        file.write(chunk)
+                        file.flush()
+                        buffer.feed(chunk)
+            status = "done"
+        except Exception as e:
+            logging.warning(f"Streaming {channel.title}: {item.title} failed", exc_info=True)
+            self.events.publish("failed", f"Streaming {channel.title}: {item.title} failed: {describe_error(e)}")
+        finally:
+            buffer.finish(failed=status != "done")
+            self.metrics.finish(transfer, status)
+            key = (channel.title, item.key())
+            if key in self.streams and self.streams[key][0] is threading.current_thread():
+                del self.streams[key]
+        if status != "done":
+            return
+        buffer.rename(filename)
+        with self.channel_lock(channel):
+            item.filename = filename
+            item.downloaded = True
+            self.save_item(item, channel)
+        self.events.publish("downloaded", f"Downloaded {channel.title}: {item.title}", item=item, channel=channel)
 
     def delete_item(self, item, channel):
+        self.wait_for_item(item, channel)
         if not item.downloaded:
             raise ManagerNotDownloaded
 
-        t = threading.Thread(target=self.delete_thread, args=(item,), name=f"Deleting {channel.title}: {item.title}")
-        t.start()
-        self.threads.append(t)
+        self.start_task((channel.title, item.key()), f"Deleting {channel.title}: {item.title}",
+                        self.delete_thread, item, channel)
 
-    def delete_thread(self, item):
+    def delete_thread(self, item, channel):
         os.remove(item.filename)
-        item.downloaded = False
-
-    def update_all(self):
+        if os.path.isfile(f"{item.filename}.frames"):
+            os.remove(f"{item.filename}.frames")
+        with self.channel_lock(channel):
+            item.downloaded = False
+            item.gain = None
+            self.save_item(item, channel)
+        self.events.publish("deleted", f"Deleted {channel.title}: {item.title}", item=item, channel=channel)
+
+    def update_all(self, max_workers=None):
+        if max_workers is None:
+            max_workers = self.max_workers
+        # The new episodes' summary, and (channel title, reason) for each feed that failed
+        channels = list(self.channels.values())
         ret = list()
-        for _, channel in self.channels.items():
-            ret.extend(self.update(channel))
-        return ret
-
-    def update(self, channel):
-        updated = False
-        try:
-            r = requests.get(self.title_to_url[channel.title])
-        except requests.exceptions.RequestException:
-            raise ManagerInvalidURL
-        channel_new = self.parse_channel(r.text)
-        ret = [f"{channel.title}\n"]
-        for item_new in channel_new.items:
-            # Assuming that all channels follow pubDate order
-            # and first mismatch means no new episodes
-            if item_new.title in self.channel_to_items[channel.title]:
-                if not updated:
-                    ret = list()
-                else:
-                    ret[-1] = ret[-1][:-1]
-                break
-            else:
-                channel.items.insert(0, item_new)
-                ret.append(f"{item_new.title}\n")
-                updated = True
-        return ret
+        failures = list()
+        if not channels:
+            return ret, failures
+        def update(channel):
+            # Off the backlog once a worker has it, whether or not it's fetched in the end
+            self.metrics.dequeue("feed")
+            return self.update(channel)
+
+        self.metrics.enqueue("feed", len(channels))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="Updating") as executor:
+            futures = [executor.submit(update, channel) for channel in channels]
+            # In channel order, one bad feed doesn't lose the others' results
+            for channel, future in zip(channels, futures):
+                try:
+                    ret.extend(future.result())
+                except Exception as e:
+                    logging.warning(f"Updating {channel.title} failed", exc_info=True)
+                    failures.append((channel.title, describe_error(e)))
+        return ret, failures
+
+    def update(self, channel, incremental=True):
+        url = self.title_to_url.get(channel.title)
+        if url is None:
+            return list()
+        # Unopened channels only need their keys, not the items themselves
+        known = channel.items if channel.items is not None else self.store.load_keys(url)
+        # Incremental updates stop parsing the feed at the first known episode
+        channel_new = self.fetch_channel(url, channel, known if incremental else None)
+        if channel_new is None:
+            # Not Modified since the last fetch
+            return list()
+        with self.channel_lock(channel):
+            if self.title_to_url.get(channel.title) != url:
+                # Unsubscribed while it was being fetched
+                return list()
+            channel.etag = channel_new.etag
+            channel.last_modified = channel_new.last_modified
+            # The Scheduler goes by these
+            channel.ttl = channel_new.ttl
+            channel.skipHours = channel_new.skipHours
+            channel.skipDays = channel_new.skipDays
+            new_items = []
+            for item_new in channel_new.items:
+                # Assuming that all channels follow pubDate order
+                # and first mismatch means no new episodes
+                if item_new.key() in known:
+                    break
+                if channel.items is not None:
+                    channel.items.add(item_new)
+                new_items.append(item_new)
+            self.store.save_channel(url, channel, new_items)
+        if not new_items:
+            return list()
+        self.render_queue.put((channel, new_items))
+        return [f"{channel.title}\n"] + [f"{item.title}\n" for item in new_items[:-1]] + [new_items[-1].title]
 
     def unsubscribe_from_channel(self, channel):
         channel_title = channel.title
+        # Stop whatever is still writing into its downloads folder
+        for download in self.downloader.queued():
+            if download.channel is channel:
+                self.downloader.cancel(channel, download.item)
+                download.done.wait()
+        for key, stream in list(self.streams.items()):
+            if key[0] == channel_title:
+                self.cancel_stream(*stream)
+        with self.tasks_lock:
+            keys = [key for key in self.tasks if isinstance(key, tuple) and key[0] == channel_title]
+        for key in keys:
+            self.wait_for(key)
         if os.path.exists(f"downloads/{channel_title}"):
             shutil.rmtree(f"downloads/{channel_title}")
-        del self.channels[self.title_to_url[channel_title]]
+        url = self.remove_channel(channel)
+        self.store.delete_channel(url)
 
     def subscribe_to_channel(self, url):
-        if url in self.channels:
+        if url in self.channels or url in self.tasks:
             raise ManagerAlreadySubscribed
 
-        t = threading.Thread(target=self.sub_to_channel_thread, args=(url,), name=f"Subscribing to {url}")
-        t.start()
-        self.threads.append(t)
+        self.start_task(url, f"Subscribing to {url}", self.sub_to_channel_thread, url)
     
     def sub_to_channel_thread(self, url):
+        channel = self.fetch_channel(url)
+        if not channel.title:
+            # Channels are looked up by title
+            raise ManagerUntitledChannel("the feed has no title")
+        self.store.save_channel(url, channel, channel.items)
+        self.add_channel(url, channel)
+        self.render_queue.put((channel, list(channel.items)))
+        self.events.publish("subscribed", f"Subscribed to {channel.title}", channel=channel)
+
+    def subscribe_all(self, urls, max_workers=None):
+        """
+        Subscribes to every url that isn't already, fetching them on a
+        bounded pool and saving them all in one transaction. Returns the new
+        channels and a (url, reason) pair for each feed that failed; the
+        same summary is announced once it's done.
+        """
+        if max_workers is None:
+            max_workers = self.max_workers
+        urls = [url for url in dict.fromkeys(urls) if url not in self.channels]
+        failures = []
+        fetched = []
+
+        def fetch(url):
+            self.metrics.dequeue("feed")
+            try:
+                return self.fetch_channel(url), None
+            except Exception as e:
+                return None, describe_error(e)
+
+        if urls:
+            # Channels are looked up by title, so those have to be unique too
+            titles = set(self.title_to_url)
+            self.metrics.enqueue("feed", len(urls))
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="Subscribing") as executor:
+                for url, (channel, error) in zip(urls, executor.map(fetch, urls)):
+                    if error is not None:
+                        failures.append((url, error))
+                    elif not channel.title:
+                        failures.append((url, "the feed has no title"))
+                    elif channel.title in titles:
+                        failures.append((url, f"already subscribed to a podcast called {channel.title}"))
+                    else:
+                        titles.add(channel.title)
+                        fetched.append((url, channel))
+            self.store.save_channels([(url, channel, channel.items) for url, channel in fetched])
+            self.add_channels(fetched)
+        for url, channel in fetched:
+            self.render_queue.put((channel, list(channel.items)))
+            self.events.publish("subscribed", channel=channel)
+        res = [f"Subscribed to {len(fetched)} of {len(urls)} new Podcasts"]
+        for url, error in failures:
+            res.append(f"  {url}: {error}")
+        self.events.publish("imported", "\n".join(res))
+        return [channel for url, channel in fetched], failures
+
+    def import_opml(self, path, max_workers=None):
+        with open(path, "rb") as file:
+            urls = parse_opml(file.read())
+        return self.subscribe_all(urls, max_workers)
+
+    def export_opml(self, path):
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(write_opml(sorted(self.channels.items(), key=lambda kv: kv[1].title.lower())))
+
+    def fetch_channel(self, url, channel=None, known_keys=None):
+        # Returns None when the feed hasn't changed since channel was fetched
+        headers = {}
+        if channel is not None:
+            if channel.etag:
+                headers["If-None-Match"] = channel.etag
+            if channel.last_modified:
+                headers["If-Modified-Since"] = channel.last_modified
+        transfer = self.metrics.start("feed", url, url)
+        status = "failed"
         try:
-            r = requests.get(url)
+            with self.session.host_slot(url):
+                with self.session.get(url, headers=headers, stream=True) as r:
+                    if r.status_code == 304:
+                        status = "not modified"
+                        return None
+                    r.raise_for_status()
+                    # Parse while the body is still coming in
+                    chunks = self.metered(transfer, r.iter_content(chunk_size=64 * 1024))
+                    channel_new = parse_channel(chunks, known_keys, channel)
+                    status = "done"
         except requests.exceptions.RequestException:
             raise ManagerInvalidURL
-        logging.debug(r.text)
-        channel = self.parse_channel(r.text)
-        self.channels[url] = channel
-        self.title_to_url[channel.title] = url
-    
-    def parse_channel(self, text):
-        root = ET.fromstring(text)
-        channel = Channel()
-        channelElement = root.find("channel")
-        channel.title = channelElement.find("title").text
-        channel.link = channelElement.find("link").text
-        channel.description = channelElement.find("description").text
-
-        channel.language = channelElement.find(
-            "language").text if channelElement.find("language") is not None else ""
-        channel.copyright = channelElement.find(
-            "copyright").text if channelElement.find("copyright") is not None else ""
-        channel.managingEditor = channelElement.find(
-            "managingEditor").text if channelElement.find("managingEditor") is not None else ""
-        channel.webMaster = channelElement.find(
-            "webMaster").text if channelElement.find("webMaster") is not None else ""
-        
-        if channelElement.find("pubDate") is not None:
-            pubDate = channelElement.find("pubDate").text
-            channel.pubDate = parse_pub_date(pubDate)
-        
-        channel.lastBuildDate = channelElement.find(
-            "lastBuildDate").text if channelElement.find("lastBuildDate") is not None else ""
-
-        for category in channelElement.findall("category"):
-            cat = Category()
-            cat.value = category.text
-            cat.domain = category.attrib["domain"] if category.attrib else ""
-            channel.category.append(cat)
-
-        channel.generator = channelElement.find(
-            "generator").text if channelElement.find("generator") is not None else ""
-        channel.docs = channelElement.find(
-            "docs").text if channelElement.find("docs") is not None else ""
-
-        if channelElement.find("cloud") is not None:
-            channel.cloud = Cloud()
-            for key, value in channelElement.find("cloud").items():
-                    setattr(channel.cloud, key, value)
-
-        channel.ttl = int(channelElement.find("ttl").text) if channelElement.find(
-            "ttl") is not None else 60
-
-        imageElement = channelElement.find("image")
-        if imageElement:
-            channel.image = Image()
-            channel.image.url = imageElement.find(
-                "url").text if imageElement.find("url") is not None else ""
-            channel.image.title = imageElement.find(
-                "title").text if imageElement.find("title") is not None else ""
-            channel.image.link = imageElement.find(
-                "link").text if imageElement.find("link") is not None else ""
-            channel.image.description = imageElement.find(
-                "description").text if imageElement.find("description") is not None else ""
-            channel.image.width = int(imageElement.find(
-                "width").text) if imageElement.find("width") is not None else 88
-            channel.image.height = int(imageElement.find(
-                "height").text) if imageElement.find("height") is not None else 31
-
-        textInputElement = channelElement.find("textinput")
-        if textInputElement:
-            channel.textInput = TextInput()
-            channel.textInput.title = textInputElement.find(
-                "title").text if textInputElement.find("title") is not None else ""
-            channel.textInput.description = textInputElement.find(
-                "description").text if textInputElement.find("description") is not None else ""
-            channel.textInput.name = textInputElement.find(
-                "name").text if textInputElement.find("name") is not None else ""
-            channel.textInput.link = textInputElement.find(
-                "link").text if textInputElement.find("link") is not None else ""
-
-        channel.skipHours = channelElement.find(
-            "skipHours").text if channelElement.find("skipHours") is not None else ""
-        channel.skipDays = channelElement.find(
-            "skipDays").text if channelElement.find("skipDays") is not None else ""
-
-        self.channel_to_items[channel.title] = set()
-
-        for itemElement in channelElement.findall("item"):
-            item = Item()
-            item.title = itemElement.find("title").text
-            item.link = itemElement.find("link").text
-            item.description = itemElement.find("description").text
-            item.author = itemElement.find("author").text if itemElement.find(
-                "author") is not None else ""
-
-            for category in itemElement.findall("category"):
-                cat = Category()
-                cat.value = category.text
-                cat.domain = category.attrib["domain"] if category.attrib else ""
-                item.category.append(cat)
-
-            item.comments = itemElement.find("comments").text if itemElement.find(
-                "comments") is not None else ""
-
-            if itemElement.find("enclosure") is not None:
-                item.enclosure = Enclosure()
-                for key, value in itemElement.find("enclosure").items():
-                    setattr(item.enclosure, key, value)
-
-            item.guid = GUID()
-            item.guid.value = itemElement.find(
-                "guid").text if itemElement.find("guid") is not None else ""
-            item.guid.isPermaLink = bool(itemElement.find(
-                "guid").attrib["isPermaLink"]) if itemElement.find("guid").keys() is not None else True
-
-            if itemElement.find("pubDate") is not None:
-                pubDate = itemElement.find("pubDate").text
-                item.pubDate = parse_pub_date(pubDate)
-
-            item.source = Source()
-            item.source.value = itemElement.find(
-                "source").text if itemElement.find("source") is not None else ""
-            item.source.url = itemElement.find(
-                "source").attrib["url"] if itemElement.find("source") is not None else ""
-
-            channel.items.append(item)
-            self.channel_to_items[channel.title].add(item.title)
-
-        channel.items.sort(key=lambda x: x.pubDate if x.pubDate is not None else datetime.now(), reverse=True)
-        return channel
-
-
-def parse_pub_date(pubDate):
-    return parse(pubDate, ignoretz=True)
+        finally:
+            self.metrics.finish(transfer, status)
+        channel_new.etag = r.headers.get("ETag", "")
+        channel_new.last_modified = r.headers.get("Last-Modified", "")
+        return channel_new
+
+
+def describe_error(e):
+    if isinstance(e, (ManagerInvalidURL, requests.exceptions.RequestException)):
+        return "couldn't be fetched"
+    return str(e) or type(e).__name__
+
+
+def write_segments(segments, state):
+    with open(f"{segments}.tmp", "w") as file:
+        json.dump(state, file)
+    os.replace(f"{segments}.tmp", segments)
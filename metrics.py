@@ -0,0 +1,171 @@
+import json
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+class Transfer:
+    def __init__(self, kind, name, url):
+        self.kind = kind
+        self.name = name
+        self.host = urlsplit(url).netloc
+        self.started = time.time()
+        self.first_byte = None
+        self.finished = None
+        self.bytes = 0
+        self.retries = 0
+        self.status = "active"
+
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    def ttfb(self):
+        if self.first_byte is None:
+            return None
+        return self.first_byte - self.started
+
+    def rate(self):
+        elapsed = self.elapsed()
+        return self.bytes / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self):
+        return {"kind": self.kind, "name": self.name, "host": self.host, "status": self.status,
+                "bytes": self.bytes, "seconds": round(self.elapsed(), 3), "bytes_per_second": round(self.rate(), 1),
+                "ttfb": round(self.ttfb(), 3) if self.ttfb() is not None else None, "retries": self.retries}
+
+class HostStats:
+    def __init__(self):
+        self.transfers = 0
+        self.failures = 0
+        self.retries = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.ttfb = 0.0
+        self.ttfb_count = 0
+
+    def to_dict(self):
+        return {"transfers": self.transfers, "failures": self.failures, "retries": self.retries, "bytes": self.bytes,
+                "bytes_per_second": round(self.bytes / self.seconds, 1) if self.seconds else 0.0,
+                "avg_ttfb": round(self.ttfb / self.ttfb_count, 3) if self.ttfb_count else None}
+
+class Metrics:
+    """
+    Throughput, time to first byte and retries of every download and feed
+    fetch, aggregated per (kind, host), plus queue depth gauges. Kept in
+    memory only, export() writes a snapshot as JSON or Prometheus text.
+    """
+    def __init__(self, history=50):
+        self.lock = threading.Lock()
+        self.active = set()
+        self.recent = deque(maxlen=history)
+        self.hosts = {}
+        self.gauges = {}
+        self.queued = {}
+
+    def add_gauge(self, name, value):
+        # value is called whenever a snapshot is taken
+        self.gauges[name] = value
+
+    def enqueue(self, kind, n=1):
+        # For work waiting in a pool outside of a gauge, taken off with dequeue() once a worker has it
+        with self.lock:
+            self.queued[kind] = self.queued.get(kind, 0) + n
+
+    def dequeue(self, kind, n=1):
+        with self.lock:
+            self.queued[kind] -= n
+
+    def start(self, kind, name, url):
+        transfer = Transfer(kind, name, url)
+        with self.lock:
+            self.active.add(transfer)
+        return transfer
+
+    def received(self, transfer, n):
+        with self.lock:
+            if transfer.first_byte is None:
+                transfer.first_byte = time.time()
+            transfer.bytes += n
+
+    def retry(self, transfer):
+        with self.lock:
+            transfer.retries += 1
+
+    def finish(self, transfer, status="done"):
+        with self.lock:
+            if transfer not in self.active:
+                return
+            transfer.finished = time.time()
+            transfer.status = status
+            self.active.discard(transfer)
+            self.recent.append(transfer)
+            stats = self.hosts.setdefault((transfer.kind, transfer.host), HostStats())
+            stats.transfers += 1
+            stats.failures += status == "failed"
+            stats.retries += transfer.retries
+            stats.bytes += transfer.bytes
+            stats.seconds += transfer.elapsed()
+            if transfer.ttfb() is not None:
+                stats.ttfb += transfer.ttfb()
+                stats.ttfb_count += 1
+
+    def snapshot(self):
+        with self.lock:
+            gauges = {f"{kind}_queue_depth": n for kind, n in self.queued.items()}
+            gauges.update((name, value()) for name, value in self.gauges.items())
+            return {"gauges": gauges,
+                    "active": [t.to_dict() for t in sorted(self.active, key=lambda t: t.started)],
+                    "recent": [t.to_dict() for t in self.recent],
+                    "hosts": [dict(kind=kind, host=host, **stats.to_dict())
+                              for (kind, host), stats in sorted(self.hosts.items())]}
+
+    def status_str(self):
+        snapshot = self.snapshot()
+        res = []
+        for name, value in snapshot["gauges"].items():
+            res.append(f"{name}: {value}\n")
+        if snapshot["active"]:
+            res.append("Active:\n")
+            for t in snapshot["active"]:
+                res.append(f"  {t['kind']} {t['name']} ({t['host']}) {format_bytes(t['bytes'])} "
+                           f"at {format_bytes(t['bytes_per_second'])}/s retries={t['retries']}\n")
+        if snapshot["hosts"]:
+            res.append("Hosts:\n")
+            for h in snapshot["hosts"]:
+                ttfb = f"{h['avg_ttfb']}s" if h['avg_ttfb'] is not None else "-"
+                res.append(f"  {h['kind']} {h['host']}: {h['transfers']} done, {h['failures']} failed, "
+                           f"{h['retries']} retries, {format_bytes(h['bytes_per_second'])}/s, ttfb {ttfb}\n")
+        return "".join(res).rstrip("\n")
+
+    def prometheus(self):
+        snapshot = self.snapshot()
+        res = []
+        for name, value in snapshot["gauges"].items():
+            res.append(f"# TYPE ycast_{name} gauge\n")
+            res.append(f"ycast_{name} {value}\n")
+        series = (("transfers_total", "transfers"), ("failures_total", "failures"), ("retries_total", "retries"),
+                  ("bytes_total", "bytes"), ("bytes_per_second", "bytes_per_second"), ("ttfb_seconds", "avg_ttfb"))
+        for metric, field in series:
+            kind = "counter" if metric.endswith("_total") else "gauge"
+            res.append(f"# TYPE ycast_{metric} {kind}\n")
+            for h in snapshot["hosts"]:
+                if h[field] is not None:
+                    res.append(f'ycast_{metric}{{kind="{h["kind"]}",host="{h["host"]}"}} {h[field]}\n')
+        return "".join(res)
+
+    def export(self, path):
+        # Prometheus text format unless the file name ends in .json
+        if path.endswith(".json"):
+            text = json.dumps(self.snapshot(), indent=2)
+        else:
+            text = self.prometheus()
+        with open(path, "w") as file:
+            file.write(text)
+
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB"):
+        if n < 1024:
+            return f"{n:.0f}{unit}"
+        n /= 1024
+    return f"{n:.1f}GB"
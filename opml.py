@@ -0,0 +1,23 @@
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape, quoteattr
+
+def parse_opml(data):
+    # Feed urls of every outline, however deeply it's nested in folders
+    root = ET.fromstring(data)
+    urls = (outline.get("xmlUrl") for outline in root.iter("outline"))
+    # Without duplicates, in the order they're listed
+    return list(dict.fromkeys(url for url in urls if url))
+
+def write_opml(channels, title="ycast subscriptions"):
+    # channels is (url, channel) pairs
+    res = []
+    res.append('<?xml version="1.0" encoding="UTF-8"?>\n')
+    res.append('<opml version="2.0">\n')
+    res.append(f"  <head>\n    <title>{escape(title)}</title>\n  </head>\n")
+    res.append("  <body>\n")
+    for url, channel in channels:
+        res.append(f'    <outline type="rss" text={quoteattr(channel.title)} title={quoteattr(channel.title)} '
+                   f"xmlUrl={quoteattr(url)} htmlUrl={quoteattr(channel.link)}/>\n")
+    res.append("  </body>\n")
+    res.append("</opml>\n")
+    return "".join(res)
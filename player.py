@@ -1,10 +1,45 @@
 from enum import Enum
 import contextlib
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
 
 with contextlib.redirect_stdout(None):
     import pygame
 
 from exceptions import YCastException
+from downloader import PRIORITY_HIGH
+from frameindex import FrameIndex, FileSlice
+
+try:
+    # Playing at anything but normal speed needs numpy
+    from timestretch import StretchedPlayback
+except ImportError:
+    StretchedPlayback = None
+
+try:
+    # So is working out how loud each episode is
+    from loudness import LoudnessAnalyzer
+except ImportError:
+    LoudnessAnalyzer = None
+
+# Seconds before the queue tries downloading an episode again after it failed
+PREFETCH_RETRY = 300
+# Enclosure types that are MP3, whatever the download's file is called
+MP3_TYPES = {"audio/mpeg", "audio/mp3", "audio/mpeg3", "audio/x-mpeg", "audio/x-mp3"}
+
+def is_mp3(item):
+    # Only MP3s are frame indexed and hinted to pygame, anything else it works out itself
+    enclosure = item.enclosure
+    if enclosure is None:
+        return False
+    if enclosure.type:
+        return enclosure.type.split(";")[0].strip().lower() in MP3_TYPES
+    return urlsplit(enclosure.url).path.lower().endswith(".mp3")
+
+def namehint(item):
+    return "mp3" if is_mp3(item) else ""
 
 class PlayerException(YCastException):
     pass
@@ -12,6 +47,18 @@ class PlayerException(YCastException):
 class PlayerInvalidVolumeChange(PlayerException):
     pass
 
+class PlayerQueueEmpty(PlayerException):
+    pass
+
+class PlayerInvalidSpeedChange(PlayerException):
+    pass
+
+class PlayerSpeedUnsupported(PlayerException):
+    pass
+
+class PlayerCannotSkip(PlayerException):
+    pass
+
 class Player:
     
     class State(Enum):
@@ -23,69 +70,393 @@ class Player:
     def __init__(self):
         self.init_mixer()
         self.volume = self.music.get_volume()
+        self.speed = 1.0
 
         self.item = None
+        self.channel = None
         self.file = None
         self.state = self.State.LOADING
+        # (channel title, item key) of the episodes to play next
         self.q = list()
+        self.init_runtime()
     
     def __getstate__(self):
         d = dict(self.__dict__)
         del d['mixer']
         del d['music']
         del d['file']
+        # Items are persisted (with their progress) by the Store
+        del d['item']
+        del d['channel']
+        del d['manager']
+        del d['queued']
+        del d['stretch']
+        del d['lock']
+        del d['monitor']
+        del d['running']
+        del d['last_pos']
+        del d['analyzer']
         return d
     
     def __setstate__(self, d):
+        self.q = list()
+        self.speed = 1.0
         self.__dict__.update(d)
+        self.item = None
+        self.channel = None
         self.file = None
         self.init_mixer()
         self.music.set_volume(self.volume)
+        self.init_runtime()
     
     def init_mixer(self):
         self.mixer = pygame.mixer
         self.mixer.init()
         self.music = self.mixer.music
 
-    def quit(self):
-        self.stop()
-        self.mixer.quit()
+    def init_runtime(self):
+        # Set by attach(), the queue needs it to find, download and stream episodes
+        self.manager = None
+        # (item, channel, file) already handed to music.queue()
+        self.queued = None
+        # StretchedPlayback when playing at a speed other than 1
+        self.stretch = None
+        self.lock = threading.RLock()
+        self.last_pos = 0
+        # (channel title, item key) -> when prefetching it last failed
+        self.prefetch_failed = {}
+        # Fills in Item.gain in the background, None without numpy
+        self.analyzer = LoudnessAnalyzer(self.analyzed) if LoudnessAnalyzer is not None else None
+        self.running = True
+        self.monitor = threading.Thread(target=self.monitor_thread, name="Player", daemon=True)
+        self.monitor.start()
+
+    def attach(self, manager):
+        self.manager = manager
+        manager.events.subscribe("downloaded", self.index)
+        manager.events.subscribe("downloaded", self.analyze)
+        manager.events.subscribe("failed", self.download_failed)
 
-    def play(self, items, channel):
-        if self.item is not None:
+    def quit(self):
+        with self.lock:
+            self.running = False
             self.stop()
-        self.item = items
-        if self.item.downloaded:
-            self.play_file(self.item, channel)
-        self.state = self.State.PLAYING
+            self.mixer.quit()
+
+    def play(self, items, channel, stream=None):
+        with self.lock:
+            if self.item is not None:
+                self.stop()
+            self.item = items
+            self.channel = channel
+            if self.item.downloaded:
+                self.play_file(self.item, channel)
+            elif stream is not None:
+                self.play_stream(self.item, stream)
+            self.state = self.State.PLAYING
+            self.last_pos = 0
+            self.prefetch()
     
     def play_file(self, item, channel):
-        self.file = open(item.filename, "rb")
-        self.music.load(self.file)
+        if self.speed != 1.0 and StretchedPlayback is not None:
+            self.stretch = StretchedPlayback(item.filename, self.speed, item.progress)
+            self.stretch.set_volume(self.item_volume(item))
+            return
+        index = FrameIndex.load(item.filename) if is_mp3(item) else None
+        if index is not None and index.offsets:
+            # Start the decoder on the frame itself rather than have it skip to start
+            offset, item.progress = index.seek(item.progress)
+            self.file = FileSlice(item.filename, offset)
+            self.music.load(self.file, "mp3")
+            self.music.set_volume(self.item_volume(item))
+            self.music.play()
+        else:
+            self.file = open(item.filename, "rb")
+            self.music.load(self.file)
+            self.music.set_volume(self.item_volume(item))
+            self.music.play(start=item.progress/1000)
+        if item.gain is None:
+            # Normalized from the next time it's played
+            self.analyze(item, channel)
+    
+    def play_stream(self, item, stream):
+        # stream is a StreamBuffer, closing it on stop leaves the download running
+        self.file = stream
+        self.music.load(self.file, namehint(item))
+        self.music.set_volume(self.item_volume(item))
         self.music.play(start=item.progress/1000)
     
     def pause(self):
-        self.item.progress += self.music.get_pos()
-        self.music.pause()
-        self.state = self.State.PAUSED
+        with self.lock:
+            if self.stretch is not None:
+                self.item.progress = self.stretch.position_ms()
+                self.stretch.pause()
+            else:
+                self.item.progress += self.music.get_pos()
+                self.music.pause()
+            self.state = self.State.PAUSED
     
     def unpause(self):
-        self.music.unpause()
-        self.state = self.State.PLAYING
+        with self.lock:
+            if self.stretch is not None:
+                self.stretch.unpause()
+            else:
+                self.music.unpause()
+            self.state = self.State.PLAYING
     
     def stop(self):
-        if self.item is not None:
-            self.item.progress += self.music.get_pos()
-        if self.file is not None:
-            self.file.close()
-        self.music.stop()
-        self.state = self.State.STOPPED
+        with self.lock:
+            if self.stretch is not None:
+                if self.item is not None:
+                    self.item.progress = self.stretch.position_ms()
+                self.stretch.stop()
+                self.stretch = None
+            elif self.item is not None and self.state == self.State.PLAYING:
+                # pause() has already counted it otherwise
+                self.item.progress += self.music.get_pos()
+            if self.file is not None:
+                self.file.close()
+            # music.stop() drops whatever was queued as well
+            self.unqueue()
+            self.music.stop()
+            self.state = self.State.STOPPED
     
     def restart(self):
-        self.music.rewind()
+        with self.lock:
+            if self.stretch is not None:
+                self.stretch.stop()
+                self.item.progress = 0
+                self.play_file(self.item, self.channel)
+            elif self.file is not None and isinstance(self.file, FileSlice):
+                # rewind() would only go back to the frame it started on
+                self.stop()
+                self.item.progress = 0
+                self.play_file(self.item, self.channel)
+                self.state = self.State.PLAYING
+                self.last_pos = 0
+                self.prefetch()
+            else:
+                self.music.rewind()
     
+    def skip(self, seconds):
+        # Jumps seconds forwards, or backwards if negative, in a downloaded episode
+        with self.lock:
+            if self.item is None or not self.item.downloaded or self.state == self.State.STOPPED:
+                raise PlayerCannotSkip
+            paused = self.state == self.State.PAUSED
+            self.stop()
+            progress = max(self.item.progress + int(seconds * 1000), 0)
+            index = FrameIndex.load(self.item.filename) if is_mp3(self.item) else None
+            if index is not None and index.offsets:
+                # Without an index the length isn't known, the mixer stops at the end anyway
+                progress = min(progress, index.duration())
+            self.item.progress = progress
+            self.play_file(self.item, self.channel)
+            self.state = self.State.PLAYING
+            self.last_pos = 0
+            self.prefetch()
+            if paused:
+                self.pause()
+
     def set_volume(self, amount):
         if amount < 0 or amount > 1:
             raise PlayerInvalidVolumeChange
-        self.volume = amount
-        self.music.set_volume(self.volume)
+        with self.lock:
+            self.volume = amount
+            self.apply_volume()
+
+    def item_volume(self, item):
+        # The user's volume with the episode's loudness gain on top
+        if item is None or item.gain is None:
+            return self.volume
+        return min(self.volume * 10 ** (item.gain / 20), 1.0)
+
+    def apply_volume(self):
+        volume = self.item_volume(self.item)
+        self.music.set_volume(volume)
+        if self.stretch is not None:
+            self.stretch.set_volume(volume)
+
+    # Analysis
+
+    def index(self, item, channel):
+        # Built once the download is done rather than when it's first played
+        if is_mp3(item):
+            FrameIndex.load(item.filename)
+
+    def analyze(self, item, channel):
+        if self.analyzer is not None and item.gain is None:
+            self.analyzer.add(item, channel)
+
+    def download_failed(self, item=None, channel=None):
+        # Other failures don't say which episode. Not under self.lock: play_item() holds it while
+        # stream_item() waits for a cancelled download, whose failure can be what's being published
+        if item is not None:
+            self.prefetch_failed[(channel.title, item.key())] = time.monotonic()
+
+    def analyzed(self, item, channel):
+        if self.manager is not None:
+            self.manager.save_item(item, channel)
+        with self.lock:
+            if item is self.item:
+                self.apply_volume()
+
+    def set_speed(self, speed):
+        if speed < 0.5 or speed > 3:
+            raise PlayerInvalidSpeedChange
+        if speed != 1.0 and StretchedPlayback is None:
+            raise PlayerSpeedUnsupported
+        with self.lock:
+            playing = self.state == self.State.PLAYING and self.item is not None and self.item.downloaded
+            if playing:
+                # Pick up again from the same spot at the new speed
+                self.stop()
+            self.speed = speed
+            if playing:
+                self.play_file(self.item, self.channel)
+                self.state = self.State.PLAYING
+                self.last_pos = 0
+
+    # Queue
+
+    def enqueue(self, item, channel):
+        with self.lock:
+            self.q.append((channel.title, item.key()))
+            self.prefetch()
+
+    def clear_queue(self):
+        with self.lock:
+            self.unqueue()
+            self.q.clear()
+
+    def play_next(self):
+        with self.lock:
+            item, channel = self.pop_next()
+            if item is None:
+                raise PlayerQueueEmpty
+            self.play_item(item, channel)
+
+    def pop_next(self):
+        while self.q:
+            title, key = self.q.pop(0)
+            item, channel = self.manager.find_item(title, key)
+            if item is not None:
+                return item, channel
+        return None, None
+
+    def play_item(self, item, channel):
+        # It might be in the middle of being deleted
+        self.manager.wait_for_item(item, channel)
+        stream = None
+        if not item.downloaded:
+            # Start listening while it downloads
+            stream = self.manager.stream_item(item, channel)
+        self.play(item, channel, stream)
+
+    def prefetch(self):
+        """
+        Gets the head of the queue ready while the current episode plays:
+        it's downloaded ahead of everything else and, once on disk, opened
+        and handed to music.queue() so the mixer switches to it without a
+        gap (and without a music.load() in between).
+        """
+        if self.manager is None or not self.q or self.queued is not None:
+            return
+        if self.state != self.State.PLAYING or self.item is None:
+            return
+        item, channel = self.manager.find_item(*self.q[0])
+        if item is None:
+            self.q.pop(0)
+            return
+        failed = self.prefetch_failed.get((channel.title, item.key()))
+        if failed is not None and time.monotonic() - failed < PREFETCH_RETRY:
+            return
+        if not item.downloaded:
+            self.manager.download_item(item, channel, PRIORITY_HIGH)
+            return
+        if self.stretch is not None:
+            # Not going through pygame.mixer.music, it's played when this one finishes
+            return
+        if item.progress:
+            # music.queue() can't start part way in, play() it when the time comes
+            return
+        try:
+            file = open(item.filename, "rb")
+        except OSError:
+            # Deleted from under it, don't try again on every tick
+            self.prefetch_failed[(channel.title, item.key())] = time.monotonic()
+            raise
+        self.music.queue(file, namehint(item))
+        self.queued = (item, channel, file)
+
+    def unqueue(self):
+        if self.queued is not None:
+            self.queued[2].close()
+            self.queued = None
+
+    def finished(self):
+        # The current episode played to the end
+        if self.stretch is not None:
+            self.stretch.stop()
+            self.stretch = None
+        self.item.progress = 0
+        if self.manager is not None:
+            self.manager.save_item(self.item, self.channel)
+            self.manager.events.publish("finished", f"Finished playing {self.channel.title}: {self.item.title}",
+                                        item=self.item, channel=self.channel)
+        if self.file is not None:
+            self.file.close()
+
+    def busy(self):
+        if self.stretch is not None:
+            return not self.stretch.finished
+        return self.music.get_busy()
+
+    def monitor_thread(self):
+        while self.running:
+            time.sleep(0.25)
+            try:
+                self.monitor_tick()
+            except Exception:
+                # One bad episode mustn't stop the queue for the rest of the session
+                logging.exception("Player monitor failed")
+
+    def monitor_tick(self):
+        with self.lock:
+            if not self.running or self.state != self.State.PLAYING or self.item is None:
+                return
+            pos = self.music.get_pos()
+            if self.queued is not None and 0 <= pos < self.last_pos:
+                # The mixer moved on to the queued episode, which restarts get_pos()
+                self.finished()
+                self.item, self.channel, self.file = self.queued
+                self.queued = None
+                self.apply_volume()
+                self.q.pop(0)
+                self.prefetch()
+            elif not self.busy() and getattr(self.file, "failed", False):
+                # The stream broke off part way, keep the place rather than finish the episode
+                self.item.progress += self.last_pos
+                if self.manager is not None:
+                    self.manager.save_item(self.item, self.channel)
+                self.file.close()
+                self.unqueue()
+                self.state = self.State.STOPPED
+            elif self.stretch is not None and self.stretch.failed:
+                # Couldn't be decoded, it hasn't played at all
+                self.stretch = None
+                if self.manager is not None:
+                    self.manager.events.publish("failed", f"Playing {self.channel.title}: {self.item.title} failed")
+                self.state = self.State.STOPPED
+            elif not self.busy():
+                self.finished()
+                item, channel = self.pop_next()
+                if item is not None:
+                    self.item = None
+                    self.play_item(item, channel)
+                else:
+                    self.state = self.State.STOPPED
+            else:
+                # Picks the next episode up once its download is done
+                self.prefetch()
+            self.last_pos = self.music.get_pos()
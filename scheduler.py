@@ -0,0 +1,131 @@
+import heapq
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# However short a feed's ttl, it isn't fetched more often than this
+MIN_INTERVAL = 15 * 60
+# Failing feeds are retried less and less often, down to once a day
+MAX_BACKOFF = 24 * 60 * 60
+DAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+class Scheduler:
+    """
+    Keeps feeds fresh in the background. Every channel is updated on its
+    own timer, its ttl plus or minus jitter, so the library is refreshed a
+    feed at a time rather than all at once. Times that fall in the
+    publisher's skipHours/skipDays are moved to the next hour outside them,
+    and feeds that fail back off exponentially.
+    """
+    def __init__(self, manager, workers=2, jitter=0.1):
+        self.manager = manager
+        self.jitter = jitter
+        self.cond = threading.Condition()
+        # (due, url) heap, due has the current time for each url, stale heap entries are skipped
+        self.heap = []
+        self.due = {}
+        self.failures = {}
+        self.running = True
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Auto sync")
+        manager.events.subscribe("subscribed", self.subscribed)
+        now = time.time()
+        for url, channel in manager.channels.items():
+            # Spread the first round out over each channel's interval
+            self.schedule(url, now + random.uniform(0, interval(channel)))
+        self.thread = threading.Thread(target=self.run, name="Scheduler", daemon=True)
+        self.thread.start()
+
+    def quit(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.thread.join()
+        self.executor.shutdown(wait=True)
+
+    def subscribed(self, channel):
+        # It's just been fetched
+        url = self.manager.title_to_url.get(channel.title)
+        if url is not None:
+            self.schedule(url, time.time() + self.jittered(interval(channel)))
+
+    def schedule(self, url, due):
+        channel = self.manager.channels.get(url)
+        if channel is None:
+            return
+        due = allowed_time(channel, due)
+        with self.cond:
+            self.due[url] = due
+            heapq.heappush(self.heap, (due, url))
+            self.cond.notify()
+
+    def jittered(self, delay):
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def run(self):
+        with self.cond:
+            while self.running:
+                if not self.heap:
+                    self.cond.wait()
+                    continue
+                due, url = self.heap[0]
+                now = time.time()
+                if due > now:
+                    self.cond.wait(due - now)
+                    continue
+                heapq.heappop(self.heap)
+                if self.due.get(url) != due:
+                    # Rescheduled since
+                    continue
+                del self.due[url]
+                self.executor.submit(self.sync, url)
+
+    def sync(self, url):
+        channel = self.manager.channels.get(url)
+        if channel is None:
+            # Unsubscribed
+            return
+        try:
+            update = self.manager.update(channel)
+        except Exception:
+            failures = self.failures.get(url, 0) + 1
+            self.failures[url] = failures
+            delay = min(interval(channel) * 2 ** failures, MAX_BACKOFF)
+            logging.warning(f"Updating {channel.title} failed {failures} times, next try in {delay // 60:.0f} minutes",
+                            exc_info=True)
+        else:
+            self.failures.pop(url, None)
+            delay = interval(channel)
+            if update:
+                self.manager.events.publish("synced", "".join(update), channel=channel)
+        if self.running:
+            self.schedule(url, time.time() + self.jittered(delay))
+
+
+def interval(channel):
+    # ttl is in minutes
+    try:
+        ttl = int(channel.ttl)
+    except (TypeError, ValueError):
+        ttl = 60
+    return max(ttl * 60, MIN_INTERVAL)
+
+
+def allowed_time(channel, due):
+    # due, or the first time after it outside the channel's skipHours/skipDays (which are GMT)
+    skip_hours = set(channel.skipHours or ())
+    skip_days = set(channel.skipDays or ())
+    moved = False
+    # A week of hours covers every combination
+    for _ in range(24 * 7):
+        t = time.gmtime(due)
+        if t.tm_hour not in skip_hours and DAYS[t.tm_wday] not in skip_days:
+            if moved:
+                # Don't have every feed with the same window come due on the hour
+                due += random.uniform(0, 10 * 60)
+            return due
+        due = due - due % 3600 + 3600
+        moved = True
+    # Skips every hour of the week, which can't be what it meant
+    return due
@@ -0,0 +1,53 @@
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    # urllib3 only decodes brotli bodies when a brotli module is importable
+    import brotli # noqa: F401
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+class Session:
+    """
+    Shared HTTP layer for the Manager. Every thread gets its own
+    requests.Session (cookies and headers aren't thread-safe) but they all
+    mount the same adapter, so keep-alive connections and TLS sessions are
+    pooled per host across threads.
+    """
+    def __init__(self, max_per_host=2, pool_connections=32, pool_maxsize=10, timeout=(10, 60)):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.host_slots = {}
+
+    def get_session(self):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("http://", self.adapter)
+            session.mount("https://", self.adapter)
+            session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+            self.local.session = session
+        return session
+
+    def host_slot(self, url):
+        # Caps the number of simultaneous connections to a single host
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self.host_slots[host]
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.get_session().get(url, **kwargs)
+
+    def close(self):
+        # The pools live on the shared adapter, not on the per-thread sessions
+        self.adapter.close()
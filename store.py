@@ -0,0 +1,184 @@
+import html
+import pickle
+import re
+import sqlite3
+import threading
+
+from feed.channel import Channel
+
+SAVE_ITEM = ("INSERT OR REPLACE INTO items (channel_url, key, data, downloaded, filename) "
+             "VALUES (?, ?, ?, ?, ?)")
+
+class Store:
+    """
+    SQLite backed persistence. Channel headers and items are stored as
+    separate rows so a change to one episode (download state, progress) is a
+    single upsert instead of a dump of the whole library, and a channel's
+    items are only read when that channel is opened.
+    """
+    def __init__(self, path):
+        self.lock = threading.RLock()
+        # Shared between the REPL and worker threads, serialized by self.lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS channels ("
+                              "url TEXT PRIMARY KEY, data BLOB NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS items ("
+                              "channel_url TEXT NOT NULL, key TEXT NOT NULL, data BLOB NOT NULL, "
+                              "downloaded INTEGER NOT NULL DEFAULT 0, filename TEXT NOT NULL DEFAULT '', "
+                              "PRIMARY KEY (channel_url, key))")
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(items)")]
+            if "downloaded" not in columns:
+                # Databases from before the downloaded/filename columns
+                self.conn.execute("ALTER TABLE items ADD COLUMN downloaded INTEGER NOT NULL DEFAULT 0")
+                self.conn.execute("ALTER TABLE items ADD COLUMN filename TEXT NOT NULL DEFAULT ''")
+                rows = self.conn.execute("SELECT channel_url, key, data FROM items").fetchall()
+                for url, key, data in rows:
+                    item = pickle.loads(data)
+                    self.conn.execute("UPDATE items SET downloaded = ?, filename = ? WHERE channel_url = ? AND key = ?",
+                                      (int(item.downloaded), item.filename, url, key))
+            self.conn.execute("CREATE INDEX IF NOT EXISTS items_downloaded ON items (downloaded)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS state ("
+                              "name TEXT PRIMARY KEY, data BLOB NOT NULL)")
+            # Full text index of episodes, search_rows gives each (channel, key) a stable rowid in it
+            # since the items rows are replaced whenever an episode is saved
+            self.conn.execute("CREATE TABLE IF NOT EXISTS search_rows ("
+                              "channel_url TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (channel_url, key))")
+            indexed = self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'search'").fetchone()
+            self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5("
+                              "title, description, author, categories, channel_title)")
+            if not indexed:
+                # Databases from before the index
+                for url, data in self.conn.execute("SELECT url, data FROM channels").fetchall():
+                    channel = load_channel(data)
+                    rows = self.conn.execute("SELECT data FROM items WHERE channel_url = ?", (url,)).fetchall()
+                    self.index_items(url, channel, [pickle.loads(data) for data, in rows])
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def is_empty(self):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM channels LIMIT 1").fetchone() is None
+
+    def load_channels(self):
+        # Headers only, items stay None until load_items
+        with self.lock:
+            rows = self.conn.execute("SELECT url, data FROM channels").fetchall()
+        return [(url, load_channel(data)) for url, data in rows]
+
+    def load_items(self, url):
+        with self.lock:
+            rows = self.conn.execute("SELECT data FROM items WHERE channel_url = ?", (url,)).fetchall()
+        return [pickle.loads(data) for data, in rows]
+
+    def load_item(self, url, key):
+        with self.lock:
+            row = self.conn.execute("SELECT data FROM items WHERE channel_url = ? AND key = ?", (url, key)).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0])
+
+    def load_downloaded(self):
+        # (channel url, key, filename) of every downloaded item, without unpickling them
+        with self.lock:
+            return self.conn.execute("SELECT channel_url, key, filename FROM items WHERE downloaded = 1").fetchall()
+
+    def load_keys(self, url):
+        with self.lock:
+            rows = self.conn.execute("SELECT key FROM items WHERE channel_url = ?", (url,)).fetchall()
+        return set(key for key, in rows)
+
+    def save_channel(self, url, channel, items=None):
+        # items (if any) are written in the same transaction as the header
+        self.save_channels([(url, channel, items)])
+
+    def save_channels(self, channels):
+        # (url, channel, items) triples, all in one transaction
+        with self.lock, self.conn:
+            for url, channel, items in channels:
+                self.conn.execute("INSERT OR REPLACE INTO channels (url, data) VALUES (?, ?)",
+                                  (url, dump_channel(channel)))
+                if items:
+                    self.conn.executemany(SAVE_ITEM, [item_row(url, item) for item in items])
+                    self.index_items(url, channel, items)
+
+    def index_items(self, url, channel, items):
+        # Only called for new or refetched episodes, their text doesn't change after that
+        for item in items:
+            key = item.key()
+            self.conn.execute("INSERT OR IGNORE INTO search_rows (channel_url, key) VALUES (?, ?)", (url, key))
+            rowid, = self.conn.execute("SELECT rowid FROM search_rows WHERE channel_url = ? AND key = ?",
+                                       (url, key)).fetchone()
+            self.conn.execute("DELETE FROM search WHERE rowid = ?", (rowid,))
+            self.conn.execute("INSERT INTO search (rowid, title, description, author, categories, channel_title) "
+                              "VALUES (?, ?, ?, ?, ?, ?)",
+                              (rowid, item.title, strip_tags(item.description), item.author,
+                               " ".join(category.value for category in item.category), channel.title))
+
+    def search(self, query, limit=50):
+        # (channel url, key) of the best matches for every word of query, the last one can be partial
+        words = ['"{}"'.format(word.replace('"', '""')) for word in query.split()]
+        if not words:
+            return []
+        match = " ".join(words) + "*"
+        with self.lock:
+            # Title matches count for the most, then the podcast's name
+            return self.conn.execute("SELECT r.channel_url, r.key FROM search JOIN search_rows r ON r.rowid = search.rowid "
+                                     "WHERE search MATCH ? ORDER BY bm25(search, 10.0, 1.0, 2.0, 2.0, 5.0) LIMIT ?",
+                                     (match, limit)).fetchall()
+
+    def save_item(self, url, item):
+        self.save_items(url, [item])
+
+    def save_items(self, url, items):
+        with self.lock, self.conn:
+            self.conn.executemany(SAVE_ITEM, [item_row(url, item) for item in items])
+
+    def delete_channel(self, url):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM search WHERE rowid IN (SELECT rowid FROM search_rows WHERE channel_url = ?)",
+                              (url,))
+            self.conn.execute("DELETE FROM search_rows WHERE channel_url = ?", (url,))
+            self.conn.execute("DELETE FROM items WHERE channel_url = ?", (url,))
+            self.conn.execute("DELETE FROM channels WHERE url = ?", (url,))
+
+    def save_state(self, name, obj):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO state (name, data) VALUES (?, ?)", (name, dump(obj)))
+
+    def load_state(self, name):
+        with self.lock:
+            row = self.conn.execute("SELECT data FROM state WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0])
+
+
+def dump(obj):
+    return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+
+def item_row(url, item):
+    return (url, item.key(), dump(item), int(item.downloaded), item.filename)
+
+
+def strip_tags(text):
+    # Descriptions are HTML, only the words are worth indexing
+    return html.unescape(re.sub(r"<[^>]*>", " ", text or ""))
+
+
+def dump_channel(channel):
+    d = channel.__getstate__()
+    d.pop('items', None)
+    return dump(d)
+
+
+def load_channel(data):
+    channel = Channel.__new__(Channel)
+    channel.__setstate__(pickle.loads(data))
+    channel.items = None
+    return channel
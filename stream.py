@@ -0,0 +1,151 @@
+import io
+import os
+import threading
+
+class StreamBuffer(io.RawIOBase):
+    """
+    Read-only file object for playing an episode while it downloads.
+
+    The downloading thread write()s into a bounded ring buffer after it has
+    written the same bytes to the cache file at path. Reads are served from
+    the ring, or from the cache file once the ring has moved past them, so
+    the player can seek anywhere that has been downloaded. When the ring is
+    full and the reader hasn't caught up the writer blocks, unless the
+    reader has been closed, in which case the download just carries on to
+    disk, or is itself waiting on data further on, in which case it reads
+    what's been dropped from the ring back from the cache file.
+    """
+    def __init__(self, path, start=0, capacity=4 * 1024 * 1024):
+        self.path = path
+        self.cond = threading.Condition()
+        self.ring = bytearray(capacity)
+        self.capacity = capacity
+        # Bytes [0, ring_start) are only in the cache file, [ring_start, written) are in the ring too
+        self.ring_start = start
+        self.written = start
+        self.size = None
+        self.eof = False
+        # Finished without the whole episode, the end of the data isn't the end of the episode
+        self.failed = False
+        self.pos = 0
+        self.file = None
+        # Readers blocked waiting for data or the size
+        self.waiting = 0
+        self.cancelled = False
+
+    # Writer side
+
+    def set_size(self, size):
+        with self.cond:
+            self.size = size
+            self.cond.notify_all()
+
+    def feed(self, data):
+        data = memoryview(data)
+        with self.cond:
+            while data:
+                if self.closed or self.cancelled:
+                    # Nobody is listening any more, or the download is being stopped
+                    self.ring_start = self.written = self.written + len(data)
+                    return
+                free = self.capacity - (self.written - self.ring_start)
+                if free == 0:
+                    if self.waiting:
+                        # Blocking would deadlock, say on a seek to the end before the size is known
+                        self.ring_start = self.written
+                    elif self.pos > self.ring_start:
+                        # Drop what's been played, it's in the cache file
+                        self.ring_start = min(self.pos, self.written)
+                    else:
+                        self.cond.wait()
+                    continue
+                n = min(free, len(data), self.capacity - self.written % self.capacity)
+                offset = self.written % self.capacity
+                self.ring[offset:offset + n] = data[:n]
+                data = data[n:]
+                self.written += n
+                self.cond.notify_all()
+
+    def cancel(self):
+        # Wakes a writer blocked on a full ring so the download can stop
+        with self.cond:
+            self.cancelled = True
+            self.cond.notify_all()
+
+    def finish(self, failed=False):
+        with self.cond:
+            self.eof = True
+            self.failed = failed
+            if self.size is None:
+                self.size = self.written
+            self.cond.notify_all()
+
+    def rename(self, path):
+        # Moves the finished cache file to path, where the reader then reads it from
+        with self.cond:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            os.replace(self.path, path)
+            self.path = path
+
+    # Reader side
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        with self.cond:
+            if whence == io.SEEK_CUR:
+                offset += self.pos
+            elif whence == io.SEEK_END:
+                while self.size is None and not self.closed:
+                    self.wait()
+                offset += self.size or 0
+            self.pos = max(offset, 0)
+            self.cond.notify_all()
+            return self.pos
+
+    def readinto(self, b):
+        with self.cond:
+            while self.pos >= self.written and not self.eof and not self.closed:
+                self.wait()
+            if self.closed or self.pos >= self.written:
+                return 0
+            if self.pos < self.ring_start:
+                if self.file is None:
+                    self.file = open(self.path, "rb")
+                self.file.seek(self.pos)
+                data = self.file.read(min(len(b), self.ring_start - self.pos))
+                n = len(data)
+                b[:n] = data
+            else:
+                offset = self.pos % self.capacity
+                n = min(len(b), self.written - self.pos, self.capacity - offset)
+                b[:n] = self.ring[offset:offset + n]
+            self.pos += n
+            self.cond.notify_all()
+            return n
+
+    def wait(self):
+        # Lets the writer know not to wait on this reader in turn
+        self.waiting += 1
+        self.cond.notify_all()
+        try:
+            self.cond.wait()
+        finally:
+            self.waiting -= 1
+
+    def close(self):
+        with self.cond:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            super().close()
+            self.cond.notify_all()
@@ -0,0 +1,48 @@
+import unittest
+
+from feed.parser import parse_channel
+
+def feed(items, trailer=""):
+    # items are (guid, day of January 2024), in document order
+    body = "".join(f"<item><title>{guid}</title><guid>{guid}</guid>"
+                   f"<pubDate>{day:02d} Jan 2024 10:00:00 +0000</pubDate></item>" for guid, day in items)
+    return f"<rss><channel><title>Test</title>{body}{trailer}</channel></rss>".encode()
+
+def guids(channel):
+    # Newest first, however the feed had them
+    return [item.guid.value for item in channel.items]
+
+class TestIncrementalParse(unittest.TestCase):
+    def test_newest_first_stops_at_known(self):
+        # g0 is older than everything known, so it's never reached
+        channel = parse_channel(feed([("g3", 3), ("g2", 2), ("g1", 1), ("g0", 0)]), {"g2", "g1"})
+        self.assertEqual(guids(channel), ["g3"])
+
+    def test_oldest_first_reads_to_the_end(self):
+        channel = parse_channel(feed([("g1", 1), ("g2", 2), ("g3", 3), ("g4", 4)]), {"g1", "g2"})
+        self.assertEqual(guids(channel), ["g4", "g3"])
+
+    def test_nothing_new(self):
+        self.assertEqual(guids(parse_channel(feed([("g2", 2), ("g1", 1)]), {"g2", "g1"})), [])
+        self.assertEqual(guids(parse_channel(feed([("g1", 1), ("g2", 2)]), {"g1", "g2"})), [])
+
+    def test_trailing_channel_fields(self):
+        trailer = "<ttl>15</ttl><skipHours><hour>3</hour></skipHours><skipDays><day>Monday</day></skipDays>"
+        previous = parse_channel(feed([("g2", 2), ("g1", 1)], trailer))
+        self.assertEqual((previous.ttl, previous.skipHours, previous.skipDays), (15, (3,), ("Monday",)))
+
+        # Stopped before the trailer, which is taken from previous rather than reset
+        data = feed([("g3", 3), ("g2", 2), ("g1", 1)], trailer.replace("15", "30"))
+        channel = parse_channel(data, {"g2", "g1"}, previous)
+        self.assertEqual(guids(channel), ["g3"])
+        self.assertEqual((channel.ttl, channel.skipHours, channel.skipDays), (15, (3,), ("Monday",)))
+        self.assertEqual(channel.title, "Test")
+
+        # Read to the end, the trailer is the feed's own
+        data = feed([("g1", 1), ("g2", 2), ("g3", 3)], trailer.replace("15", "30"))
+        channel = parse_channel(data, {"g1", "g2"}, previous)
+        self.assertEqual(guids(channel), ["g3"])
+        self.assertEqual(channel.ttl, 30)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,181 @@
+import logging
+import threading
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import pygame
+
+class WSOLA:
+    """
+    Waveform similarity overlap-add time stretch. Changes tempo without
+    changing pitch by cutting the input into overlapping Hann windowed
+    frames, taken speed times further apart than they are laid down, and
+    nudging each frame by up to search samples so its waveform lines up with
+    what was laid down before it.
+
+    Works on a (samples, channels) array in chunks; process() returns the
+    next n frames of output and keeps the overlap state for the next call.
+    """
+    def __init__(self, samples, speed, start=0, frame=1024, search=256):
+        self.samples = samples
+        self.speed = speed
+        self.frame = frame
+        self.hop = frame // 2
+        self.search = search
+        # Periodic Hann windows at 50% overlap sum to exactly one
+        self.window = np.hanning(frame + 1)[:frame].astype(np.float32)
+        if samples.ndim > 1:
+            self.window = self.window[:, None]
+        self.start = start
+        self.k = 0
+        self.prev = start
+        self.tail = np.zeros((frame - self.hop,) + samples.shape[1:], dtype=np.float32)
+
+    def position(self):
+        # Input sample the next output frame starts from
+        return self.start + int(self.k * self.hop * self.speed)
+
+    def done(self):
+        return self.position() + self.frame >= len(self.samples)
+
+    def mono(self, start, end):
+        # Only ever the window being searched, a mono copy of the whole episode is as big as the episode
+        part = self.samples[start:end]
+        return part.mean(axis=1, dtype=np.float32) if part.ndim > 1 else part.astype(np.float32)
+
+    def best_offset(self, nominal):
+        # Continuation of the previous frame is what the next one should look like
+        natural = self.prev + self.hop
+        template = self.mono(natural, natural + self.hop)
+        lo = max(nominal - self.search, 0)
+        hi = min(nominal + self.search, len(self.samples) - self.frame)
+        if hi <= lo or len(template) < self.hop:
+            return min(max(nominal, 0), max(len(self.samples) - self.frame, 0))
+        candidates = sliding_window_view(self.mono(lo, hi + self.hop), self.hop)
+        return lo + int(np.argmax(candidates @ template))
+
+    def process(self, n):
+        out = np.empty((n * self.hop,) + self.samples.shape[1:], dtype=np.float32)
+        for i in range(n):
+            if self.done():
+                out = out[:i * self.hop]
+                break
+            pos = self.best_offset(self.position())
+            frame = self.samples[pos:pos + self.frame].astype(np.float32) * self.window
+            frame[:len(self.tail)] += self.tail
+            out[i * self.hop:(i + 1) * self.hop] = frame[:self.hop]
+            self.tail = frame[self.hop:]
+            self.prev = pos
+            self.k += 1
+        return out
+
+class StretchedPlayback:
+    """
+    Plays a downloaded episode at speed through a pygame.mixer.Channel.
+    A feeder thread decodes the file to PCM once, then time stretches it a
+    chunk at a time and keeps the next chunk queued on the channel.
+    """
+    CHUNK_SECONDS = 0.5
+
+    def __init__(self, filename, speed, start_ms=0):
+        self.filename = filename
+        self.rate = pygame.mixer.get_init()[0]
+        self.speed = speed
+        self.start_ms = start_ms
+        # Set by the feeder once the file is decoded
+        self.stretch = None
+        self.failed = False
+        self.channel = pygame.mixer.find_channel(True)
+        # [source sample, time it started playing or None] per chunk on the channel
+        self.chunks = []
+        self.paused = None
+        self.stopped = False
+        self.finished = False
+        self.lock = threading.Lock()
+        self.feeder = threading.Thread(target=self.feed, name="Time stretch", daemon=True)
+        self.feeder.start()
+
+    def decode(self):
+        # Takes a while for a long episode, which is why it isn't done by whoever called play
+        try:
+            sound = pygame.mixer.Sound(file=self.filename)
+        except pygame.error:
+            logging.exception(f"Decoding {self.filename} failed")
+            return False
+        # A view onto the decoded sound, not a copy
+        samples = pygame.sndarray.samples(sound)
+        stretch = WSOLA(samples, self.speed, int(self.start_ms * self.rate / 1000))
+        with self.lock:
+            self.sound = sound
+            self.samples = samples
+            self.stretch = stretch
+        return True
+
+    def feed(self):
+        if not self.decode():
+            self.failed = True
+            self.finished = True
+            return
+        frames = max(int(self.CHUNK_SECONDS * self.rate / self.stretch.hop), 1)
+        while not self.stopped:
+            with self.lock:
+                if self.stopped:
+                    return
+                if self.paused is None:
+                    if self.chunks and not self.channel.get_busy():
+                        # Ran dry, everything queued has been played
+                        self.chunks.clear()
+                    elif len(self.chunks) == 2 and self.channel.get_queue() is None:
+                        # The channel moved on to the queued chunk
+                        self.chunks.pop(0)
+                        self.chunks[0][1] = time.time()
+                    if len(self.chunks) < 2 and not self.stretch.done():
+                        pos = self.stretch.position()
+                        pcm = self.stretch.process(frames)
+                        pcm = np.clip(pcm, -32768, 32767).astype(self.samples.dtype)
+                        # queue() plays straight away on an idle channel
+                        started = None if self.channel.get_busy() else time.time()
+                        self.channel.queue(pygame.sndarray.make_sound(pcm))
+                        self.chunks.append([pos, started])
+                        continue
+                    if not self.chunks and self.stretch.done():
+                        self.finished = True
+                        return
+            time.sleep(0.05)
+
+    def position_ms(self):
+        with self.lock:
+            if self.stretch is None:
+                return self.start_ms
+            if not self.chunks or self.chunks[0][1] is None:
+                return self.stretch.position() * 1000 // self.rate
+            pos, started = self.chunks[0]
+            elapsed = (self.paused or time.time()) - started
+        return int(pos * 1000 / self.rate + elapsed * self.speed * 1000)
+
+    def pause(self):
+        with self.lock:
+            self.paused = time.time()
+            self.channel.pause()
+
+    def unpause(self):
+        with self.lock:
+            if self.paused is None:
+                return
+            # Shift the start times so the pause doesn't count as played
+            for chunk in self.chunks:
+                if chunk[1] is not None:
+                    chunk[1] += time.time() - self.paused
+            self.paused = None
+            self.channel.unpause()
+
+    def stop(self):
+        # Not waiting for the feeder, it may still be decoding; it queues nothing more once stopped
+        with self.lock:
+            self.stopped = True
+            self.channel.stop()
+
+    def set_volume(self, volume):
+        self.channel.set_volume(volume)
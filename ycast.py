@@ -6,37 +6,56 @@ import sys
 import os
 import pickle
 
-from manager import Manager, ManagerNotDownloaded, ManagerAlreadyDownloaded, ManagerAlreadySubscribed
-from player import Player, PlayerInvalidVolumeChange
+from store import Store
+from manager import Manager, ManagerNotDownloaded, ManagerAlreadyDownloaded, ManagerAlreadySubscribed, ManagerNotDownloading
+from player import Player, PlayerInvalidVolumeChange, PlayerQueueEmpty, PlayerInvalidSpeedChange, PlayerSpeedUnsupported, PlayerCannotSkip
+from scheduler import Scheduler
 from paginator import Paginator, FirstPageException, LastPageException
 
 class YCast:
     def __init__(self):
         self.quit = False
-        self.manager = Manager()
-        self.player = Player()
 
         signal.signal(signal.SIGINT, self.handle_exit_sig)
 
         if not os.path.exists("config"):
             os.makedirs("config")
-        else:
+        self.store = Store("config/ycast.db")
+        if self.store.is_empty():
+            self.import_pickles()
+
+        self.manager = Manager(self.store)
+        self.player = self.store.load_state("player")
+        if self.player is None:
+            self.player = Player()
+        self.player.attach(self.manager)
+        # Keeps feeds up to date without having to sync
+        self.scheduler = Scheduler(self.manager)
+
+    def import_pickles(self):
+        # Libraries saved before the Store existed
+        if os.path.isfile("config/manager.pkl"):
             with open("config/manager.pkl", "rb") as input:
-                self.manager = pickle.load(input)
+                manager = pickle.load(input)
+            for url, channel in manager.channels.items():
+                self.store.save_channel(url, channel, channel.items)
+            os.rename("config/manager.pkl", "config/manager.pkl.bak")
+        if os.path.isfile("config/player.pkl"):
             with open("config/player.pkl", "rb") as input:
-                self.player = pickle.load(input)
+                player = pickle.load(input)
+            self.store.save_state("player", player)
+            os.rename("config/player.pkl", "config/player.pkl.bak")
     
     def handle_exit_sig(self, sig, frame):
         self.handle_exit()
         sys.exit(0)
 
     def handle_exit(self):
-        self.player.quit()
+        self.playback(self.player.quit)
+        self.scheduler.quit()
         self.manager.quit()
-        with open("config/manager.pkl", "wb") as output:
-            pickle.dump(self.manager, output, pickle.HIGHEST_PROTOCOL)
-        with open("config/player.pkl", "wb") as output:
-            pickle.dump(self.player, output, pickle.HIGHEST_PROTOCOL)
+        self.store.save_state("player", self.player)
+        self.store.close()
         self.quit = True
         print("Goodbye!")
     
@@ -45,6 +64,9 @@ class YCast:
         # GRC http://leoville.tv/podcasts/sn.xml
         # CC https://corridorcast.libsyn.com/rss
         while not self.quit:
+            # Whatever finished in the background since the last command
+            for message in self.manager.events.drain():
+                print(message)
             # TODO: Replace with cli.py
             line = input("ycast> ")
             logging.debug(line)
@@ -90,18 +112,35 @@ class YCast:
                 if args is None:
                     print("Please specify a Podcast to subscribe to!")
                     continue
-                for url in args.split(" "):
-                    try:
-                        self.manager.subscribe_to_channel(url)
-                    except ManagerAlreadySubscribed:
-                        print("Podcast {url} already subscribed to!")
+                urls = args.split()
+                if len(urls) > 1:
+                    # Fetched on a bounded pool, the summary is announced when it's done
+                    self.manager.start_task(args, f"Subscribing to {len(urls)} Podcasts", self.manager.subscribe_all, urls)
+                    continue
+                try:
+                    self.manager.subscribe_to_channel(urls[0])
+                except ManagerAlreadySubscribed:
+                    print(f"Podcast {urls[0]} already subscribed to!")
+
+            elif cmd == "import":
+                if args is None:
+                    print("Please specify an OPML file to import!")
+                    continue
+                if not os.path.isfile(args):
+                    print(f"No such file {args}")
+                    continue
+                self.manager.start_task(args, f"Importing {args}", self.manager.import_opml, args)
+
+            elif cmd == "export":
+                if args is None:
+                    print("Please specify a file to export to!")
+                    continue
+                self.manager.export_opml(args)
             
             elif cmd == "unsubscribe" or cmd == "unsub" or cmd == "remove":
-                self.manager.wait_for_all_threads()
                 self.get_channel_apply("Unsubscribe", self.manager.unsubscribe_from_channel)
             
             elif cmd == "list" or cmd == "ls":
-                self.manager.wait_for_all_threads()
                 self.show_all()
             
             elif cmd == "download" or cmd == "d":
@@ -110,43 +149,92 @@ class YCast:
                 except ManagerAlreadyDownloaded:
                     print("Episode has already been downloaded")
             
+            elif cmd == "cancel":
+                try:
+                    self.get_items_apply("Cancel", self.manager.cancel_download)
+                except ManagerNotDownloading:
+                    print("Episode isn't being downloaded!")
+
             elif cmd == "delete" or cmd == "del":
-                self.manager.wait_for_all_threads()
                 try:
                     self.get_items_apply("Delete", self.manager.delete_item)
                 except ManagerNotDownloaded:
                     print("Episode hasn't been downloaded yet!")
             
             elif cmd == "sync":
-                updates = self.manager.update_all()
+                updates, failures = self.manager.update_all()
                 if updates:
                     print(updates)
                 else:
                     print("No new Episodes")
+                for title, error in failures:
+                    print(f"Couldn't update {title}: {error}")
+
+            elif cmd == "search" or cmd == "find":
+                if args is None:
+                    print("Please specify what to search for!")
+                    continue
+                results = self.manager.search(args)
+                if not results:
+                    print("No matching Episodes")
+                    continue
+                self.search_apply(results)
 
             elif cmd == "update" or cmd == "u":
                 self.get_channel_apply("Update", self.update_channel)
             
+            elif cmd == "status":
+                if args is not None:
+                    self.manager.metrics.export(args)
+                else:
+                    print(self.manager.metrics.status_str() or "Nothing to report")
+
             elif cmd == "quit" or cmd == "q" or cmd == "exit":
                 self.handle_exit()
             
             # Playback Commands
 
             elif cmd == "play" or cmd == "p":
-                self.manager.wait_for_all_threads()
-                self.get_items_apply("Play", self.player.play)
+                self.get_items_apply("Play", lambda i, c: self.playback(self.player.play_item, i, c))
+
+            elif cmd == "queue" or cmd == "enqueue":
+                self.get_items_apply("Queue", self.player.enqueue)
+
+            elif cmd == "next":
+                try:
+                    self.playback(self.player.play_next)
+                except PlayerQueueEmpty:
+                    print("Nothing queued!")
+
+            elif cmd == "clearqueue":
+                self.player.clear_queue()
 
             elif cmd == "pause":
-                self.player.pause()
+                self.playback(self.player.pause)
             
             elif cmd == "unpause" or cmd == "continue":
                 self.player.unpause()
             
             elif cmd == "stop":
-                self.player.stop()
+                self.playback(self.player.stop)
             
             elif cmd == "restart":
                 self.player.restart()
+
+            elif cmd == "skip" or cmd == "ff" or cmd == "back" or cmd == "rw":
+                seconds = 30
+                if args is not None:
+                    try:
+                        seconds = float(args)
+                    except ValueError:
+                        print("Invalid Number of Seconds")
+                        continue
+                if cmd == "back" or cmd == "rw":
+                    seconds = -seconds
+                try:
+                    self.playback(self.player.skip, seconds)
+                except PlayerCannotSkip:
+                    print("Can only skip in a downloaded Episode that's playing")
             
             elif cmd == "volume":
                 if args is None:
@@ -164,9 +252,30 @@ class YCast:
                 except PlayerInvalidVolumeChange:
                     print("Volume Value must be between 0 and 10")
 
+            elif cmd == "speed":
+                if args is None:
+                    print(f"Playing at {self.player.speed}x")
+                    continue
+
+                try:
+                    self.playback(self.player.set_speed, float(args))
+                except ValueError:
+                    print("Invalid Speed Value")
+                except PlayerInvalidSpeedChange:
+                    print("Speed must be between 0.5 and 3")
+                except PlayerSpeedUnsupported:
+                    print("Changing speed needs numpy to be installed")
+
             else:
                 print("Invalid Command!")
 
+    def playback(self, action, *args):
+        # Save the progress of whatever was playing before action
+        item, channel = self.player.item, self.player.channel
+        action(*args)
+        if item is not None:
+            self.manager.save_item(item, channel)
+
     def update_channel(self, channel):
         update = self.manager.update(channel)
         if update:
@@ -179,12 +288,13 @@ class YCast:
         while item_index is None:
             channel = self.select_channel("List")
             if channel is not None:
+                self.manager.load_items(channel)
                 paginator = Paginator(channel.items)
 
                 while True:
                     # TODO: Replace with cli.py
                     for i, item in enumerate(paginator.get_current_page()):
-                        print(f"  {i+paginator.current_min}) {item.title} ({item.enclosure.url}) Downloaded={item.downloaded}")
+                        print(f"  {i+paginator.current_min}) {item.list_str()}")
 
                     item_index = input(f"{channel.title}> ")
                     if item_index == "n":
@@ -209,6 +319,7 @@ class YCast:
         while item_indexes is None:
             channel = self.select_channel(purpose)
             if channel is not None:
+                self.manager.load_items(channel)
                 item_indexes = self.select_item_indexes(channel, purpose)
                 if item_indexes is not None:
                     for item_index in item_indexes:
@@ -217,6 +328,61 @@ class YCast:
             else:
                 break
 
+    def search_apply(self, results):
+        actions = {
+            "play": lambda i, c: self.playback(self.player.play_item, i, c),
+            "download": self.manager.download_item,
+            "queue": self.player.enqueue,
+            "info": lambda i, c: print(i.info_str()),
+            "cancel": self.manager.cancel_download,
+            "delete": self.manager.delete_item,
+        }
+        paginator = Paginator(results)
+
+        while True:
+            # TODO: Replace with cli.py
+            for i, (item, channel) in enumerate(paginator.get_current_page()):
+                print(f"  {i+paginator.current_min}) {channel.title}: {item.title} Downloaded={item.downloaded}")
+
+            line = input(f"What do you want to do ({', '.join(actions)}) and with which? ")
+            if line == "n":
+                self.paginator_next(paginator)
+                continue
+            elif line == "p":
+                self.paginator_prev(paginator)
+                continue
+            elif line == "q":
+                return
+
+            line = line.split(" ", 1)
+            if line[0] not in actions or len(line) < 2:
+                print("Invalid Input! e.g. download 0 3")
+                continue
+            try:
+                item_indexes = list(map(int, line[1].split()))
+            except ValueError:
+                print("Invalid Input!")
+                continue
+            if any(i >= len(results) or i < 0 for i in item_indexes):
+                print(f"Options must be between {0} and {len(results)-1}")
+                continue
+
+            for i in item_indexes:
+                # The channel's own copy, loading it if it hasn't been yet
+                item, channel = self.manager.find_item(results[i][1].title, results[i][0].key())
+                if item is None:
+                    print(f"{results[i][0].title} is no longer there")
+                    continue
+                try:
+                    actions[line[0]](item, channel)
+                except ManagerAlreadyDownloaded:
+                    print(f"{item.title} has already been downloaded")
+                except ManagerNotDownloaded:
+                    print(f"{item.title} hasn't been downloaded yet!")
+                except ManagerNotDownloading:
+                    print(f"{item.title} isn't being downloaded!")
+            return
+
     def select_channel(self, purpose):
         channels = list(self.manager.channels.values())
         paginator = Paginator(channels)
@@ -245,11 +411,12 @@ class YCast:
                     print("Invalid Input!")
                     continue
 
-                if channel_index > len(self.manager.channels.keys()) or channel_index < 0:
-                    print(f"Option must be between {0} and {len(self.manager.channels.keys())}")
+                if channel_index >= len(channels) or channel_index < 0:
+                    print(f"Option must be between {0} and {len(channels) - 1}")
                     continue
 
-                return self.manager.channels[self.manager.title_to_url[channels[channel_index].title]]
+                # channels is a snapshot, the Manager's dicts may have moved on since
+                return channels[channel_index]
 
     def select_item_indexes(self, channel, purpose):
         items = channel.items
@@ -261,7 +428,7 @@ class YCast:
             # TODO: Replace with cli.py
             cont = False
             for i, item in enumerate(paginator.get_current_page()):
-                print(f"  {i+paginator.current_min}) {item.title} ({item.enclosure.url}) Downloaded={item.downloaded}")
+                print(f"  {i+paginator.current_min}) {item.list_str()}")
 
             item_indexes = input(f"Which Items do you want {purpose}? ")
             if item_indexes == "n":
@@ -280,7 +447,7 @@ class YCast:
                     continue
 
                 for i in item_indexes:
-                    if i > len(channel.items) or i < 0:
+                    if i >= len(channel.items) or i < 0:
                         print(f"Options must be between {0} and {len(channel.items)-1}")
                         cont = True
                         break